@@ -0,0 +1,55 @@
+"""
+Time of cluster_topics against cluster_topics_scalable on synthetic topic columns of growing size.
+Topics are drawn with a Zipf distribution from a pool of distinct strings, as repeated coverage of the same
+stories produces many identical topics. The full-batch path is skipped above --max-full rows.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_clustering
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from news_mapping.clustering.clustering import cluster_topics, cluster_topics_scalable
+
+WORDS = (
+    "elezioni europee voto governo riforma lavoro pensioni sanità scuola clima energia guerra ucraina "
+    "gaza migranti sbarchi economia inflazione tasse bilancio difesa nato commissione parlamento "
+    "campagna sondaggi affluenza candidati liste premier opposizione alleanze autonomia giustizia"
+).split()
+
+
+def synthetic_topics(n_rows: int, n_unique: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    pool = [" ".join(rng.choice(WORDS, size=rng.integers(2, 5), replace=False)) for _ in range(n_unique)]
+    ranks = np.minimum(rng.zipf(1.3, size=n_rows), n_unique) - 1
+    return pd.DataFrame({"topics": np.asarray(pool, dtype=object)[ranks]})
+
+
+def timed(func, dataframe, topics) -> float:
+    start = time.perf_counter()
+    func(dataframe.copy(), topics)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--unique", type=int, default=2000)
+    parser.add_argument("--max-full", type=int, default=10000)
+    args = parser.parse_args()
+
+    predefined = ["elezioni europee", "guerra ucraina", "economia inflazione", "migranti sbarchi"]
+    print(f"{'rows':>8}{'topics':>14}{'full':>10}{'scalable':>10}")
+    for size in args.sizes:
+        dataframe = synthetic_topics(size, args.unique)
+        for topics, label in [(predefined, "predefined"), (None, "hdbscan")]:
+            full = f"{timed(cluster_topics, dataframe, topics):.2f}s" if size <= args.max_full else "-"
+            scalable = f"{timed(cluster_topics_scalable, dataframe, topics):.2f}s"
+            print(f"{size:>8}{label:>14}{full:>10}{scalable:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Accuracy and speed of the near-duplicate pass on synthetic articles.
+Every story is published in several versions, each with a share of its words replaced, so the pairs of versions
+span the whole range of Jaccard similarities. The benchmark reports the error of the MinHash estimate of the
+Jaccard similarity, checks that no pair below the threshold is merged, and reports the share of pairs above the
+threshold that are found.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_dedup
+"""
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from news_mapping.data.dedup import MinHashLSH, jaccard, near_duplicates, shingles
+
+
+def make_texts(stories: int, versions: int, words: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"parola{i}" for i in range(20000)]
+    texts = []
+    for _ in range(stories):
+        base = rng.choice(vocabulary, size=words)
+        for _ in range(versions):
+            version = base.copy()
+            replaced = rng.random(words) < rng.uniform(0, 0.08)
+            version[replaced] = rng.choice(vocabulary, size=replaced.sum())
+            texts.append(" ".join(version))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stories", type=int, default=100)
+    parser.add_argument("--versions", type=int, default=5)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--threshold", type=float, default=0.8)
+    args = parser.parse_args()
+
+    texts = make_texts(args.stories, args.versions, args.words)
+    shingle_sets = [shingles(text) for text in texts]
+    lsh = MinHashLSH()
+    signatures = np.vstack([lsh.signature(s) for s in shingle_sets])
+
+    # pairs of versions of the same story (all similarities) and pairs of different stories (similarity ~0)
+    pairs = [
+        (i, j) for story in range(args.stories)
+        for i, j in itertools.combinations(range(story * args.versions, (story + 1) * args.versions), 2)
+    ] + [(i, i + args.versions) for i in range(0, len(texts) - args.versions, args.versions)]
+    exact = np.array([jaccard(shingle_sets[i], shingle_sets[j]) for i, j in pairs])
+    estimated = np.array([np.mean(signatures[i] == signatures[j]) for i, j in pairs])
+
+    start = time.perf_counter()
+    groups = near_duplicates(texts, threshold=args.threshold)
+    elapsed = time.perf_counter() - start
+    merged = np.array([groups[i] == groups[j] for i, j in pairs])
+
+    above = exact >= args.threshold
+    unrelated = np.array([i // args.versions != j // args.versions for i, j in pairs])
+    print(f"texts: {len(texts)}, pairs: {len(pairs)}, near_duplicates: {elapsed:.2f}s")
+    print(f"MinHash estimate: mean abs error {np.mean(np.abs(estimated - exact)):.3f}, "
+          f"max {np.max(np.abs(estimated - exact)):.3f}")
+    print(f"pairs above threshold found: {merged[above].sum()}/{above.sum()}")
+    # a pair below the threshold can be merged through a chain of versions above it, different stories never
+    print(f"pairs below threshold merged: {merged[~above].sum()}/{(~above).sum()}, "
+          f"pairs of different stories merged: {merged[unrelated].sum()}/{unrelated.sum()}")
+    assert not merged[unrelated].any(), "articles of different stories were merged"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Wall-clock time of the topic and person extraction stage against a mocked LLM endpoint,
+for several in-flight limits. The stub answers every chat completion after a fixed latency,
+so the time should scale with articles / max_in_flight rather than with the article count.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_extraction
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from news_mapping.data.rate_limiter import RateLimiter
+from news_mapping.data.wrangler import obtain_topics_and_persons
+
+COMPLETION = json.dumps(
+    {
+        "id": "stub",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "stub",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {
+                    "role": "assistant",
+                    "content": '{"text": "riassunto", "topic": "elezioni", "persons": ["Mario Rossi"]}',
+                },
+            }
+        ],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+    }
+).encode()
+
+
+def make_handler(latency: float):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(COMPLETION)))
+            self.end_headers()
+            self.wfile.write(COMPLETION)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--articles", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    texts = [f"Articolo numero {i} sulle elezioni europee." for i in range(args.articles)]
+    print(f"{args.articles} articles, {args.latency * 1000:.0f} ms per completion")
+    for max_in_flight in args.in_flight:
+        start = time.perf_counter()
+        outputs, errors = obtain_topics_and_persons(
+            texts,
+            api_key="stub",
+            query="elezioni europee",
+            topics_to_scrape=None,
+            rate_limiter=RateLimiter(requests_per_minute=None),
+            max_in_flight=max_in_flight,
+        )
+        elapsed = time.perf_counter() - start
+        assert not any(errors) and all(outputs)
+        print(f"max_in_flight={max_in_flight:>3}: {elapsed:.2f}s")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
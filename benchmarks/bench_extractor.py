@@ -0,0 +1,33 @@
+"""
+Parse time and output length of the text extractors on the saved HTML pages in benchmarks/fixtures.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_extractor
+"""
+import argparse
+import time
+from pathlib import Path
+
+from news_mapping.data.extractor import EXTRACTORS
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'fixture':<22}{'extractor':<10}{'ms/page':>10}{'chars':>10}")
+    for fixture in sorted(FIXTURES.glob("*.html")):
+        html_string = fixture.read_text(encoding="utf-8")
+        for name, extract in EXTRACTORS.items():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                text = extract(html_string)
+            elapsed = (time.perf_counter() - start) / args.repeat
+            print(f"{fixture.stem:<22}{name:<10}{elapsed * 1000:>10.2f}{len(text):>10}")
+
+
+if __name__ == "__main__":
+    main()
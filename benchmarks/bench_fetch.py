@@ -0,0 +1,93 @@
+"""
+Throughput of the sequential scrape_url path against the concurrent scrape_urls engine,
+on local HTTP stub servers that answer every request after a fixed latency.
+With --parse-workers, the concurrent engine also runs with pages parsed on a process pool.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_fetch
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from news_mapping.data.scraper import scrape_url, scrape_urls
+
+PAGE = (
+    "<html><head><title>Articolo</title></head><body>"
+    + "<p>Testo dell'articolo di prova.</p>" * 200
+    + "</body></html>"
+).encode()
+
+
+def make_handler(latency: float):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def start_servers(n_hosts: int, latency: float) -> list:
+    servers = []
+    for _ in range(n_hosts):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(latency))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", type=int, default=200)
+    parser.add_argument("--hosts", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--parse-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    servers = start_servers(args.hosts, args.latency)
+    urls = [
+        f"http://127.0.0.1:{servers[i % args.hosts].server_address[1]}/article/{i}"
+        for i in range(args.urls)
+    ]
+
+    start = time.perf_counter()
+    sequential = [scrape_url(url) for url in urls]
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    concurrent = scrape_urls(urls)
+    concurrent_time = time.perf_counter() - start
+
+    assert sequential == concurrent
+    print(f"{args.urls} urls over {args.hosts} hosts, {args.latency * 1000:.0f} ms latency")
+    print(f"sequential: {sequential_time:.2f}s ({args.urls / sequential_time:.1f} urls/s)")
+    print(f"concurrent: {concurrent_time:.2f}s ({args.urls / concurrent_time:.1f} urls/s)")
+    print(f"speedup:    {sequential_time / concurrent_time:.1f}x")
+
+    if args.parse_workers:
+        start = time.perf_counter()
+        pooled = scrape_urls(urls, parse_workers=args.parse_workers)
+        pooled_time = time.perf_counter() - start
+        assert pooled == sequential
+        print(
+            f"concurrent, {args.parse_workers} parse processes: {pooled_time:.2f}s "
+            f"({args.urls / pooled_time:.1f} urls/s)"
+        )
+
+    for server in servers:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
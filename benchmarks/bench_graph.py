@@ -0,0 +1,96 @@
+"""
+Build time of ArticleGraph on synthetic article tables of growing size, with newspaper -> topic and
+person -> topic relationships and a list-valued persons column.
+The previous row-by-row construction (iterrows and one add_node/add_edge call per pair) is timed as a baseline
+on the persons column already exploded, and skipped above --max-legacy rows.
+For every size, sliding the window by --slide articles (add_articles of the newest, remove_articles of the oldest)
+is timed against a full rebuild.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_graph
+"""
+import argparse
+import time
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+from news_mapping.graph.graph import ArticleGraph
+
+RELATIONSHIPS = [
+    {"source": "newspaper", "target": "topics", "relationship": "covers"},
+    {"source": "persons", "target": "topics", "relationship": "mentioned in"},
+]
+
+
+def synthetic_articles(n_rows: int, n_topics: int = 5000, n_persons: int = 20000, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    newspapers = np.array([f"newspaper {i}" for i in range(20)], dtype=object)
+    topics = np.array([f"topic {i}" for i in range(n_topics)], dtype=object)
+    persons = np.array([f"person {i}" for i in range(n_persons)], dtype=object)
+    person_ids = np.minimum(rng.zipf(1.5, size=n_rows * 4), n_persons) - 1
+    n_mentioned = rng.integers(0, 5, size=n_rows)
+    offsets = np.concatenate([[0], np.cumsum(n_mentioned)])
+    return pd.DataFrame({
+        "link": [f"https://example.com/{seed}/{i}" for i in range(n_rows)],
+        "newspaper": newspapers[rng.integers(0, len(newspapers), size=n_rows)],
+        "topics": topics[np.minimum(rng.zipf(1.3, size=n_rows), n_topics) - 1],
+        "persons": [persons[person_ids[offsets[i]:offsets[i + 1]]].tolist() for i in range(n_rows)],
+    })
+
+
+def legacy_build(dataframe: pd.DataFrame, relationships: list) -> nx.Graph:
+    graph = nx.Graph()
+    node_frequencies = {}
+    for _, row in dataframe.iterrows():
+        for relation in relationships:
+            for node in (row[relation["source"]], row[relation["target"]]):
+                node_frequencies[node] = node_frequencies.get(node, 0) + 1
+    for _, row in dataframe.iterrows():
+        for relation in relationships:
+            source = row[relation["source"]]
+            target = row[relation["target"]]
+            graph.add_node(source, type=relation["source"])
+            graph.add_node(target, type=relation["target"])
+            graph.add_edge(source, target, relationship=relation["relationship"])
+    return graph
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--max-legacy", type=int, default=10000)
+    parser.add_argument("--slide", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9}{'nodes':>9}{'edges':>9}{'legacy':>10}{'bulk':>10}{'slide':>10}{'rebuild':>10}")
+    for size in args.sizes:
+        dataframe = synthetic_articles(size)
+
+        legacy = "-"
+        if size <= args.max_legacy:
+            exploded = dataframe.explode("persons").dropna()
+            start = time.perf_counter()
+            legacy_build(exploded, RELATIONSHIPS)
+            legacy = f"{time.perf_counter() - start:.2f}s"
+
+        start = time.perf_counter()
+        graph = ArticleGraph(dataframe, RELATIONSHIPS)
+        bulk = f"{time.perf_counter() - start:.2f}s"
+        nodes, edges = graph.G.number_of_nodes(), graph.G.number_of_edges()
+
+        newest = synthetic_articles(args.slide, seed=size)
+        start = time.perf_counter()
+        graph.add_articles(newest)
+        graph.remove_articles(dataframe["link"].iloc[:args.slide])
+        slide = f"{time.perf_counter() - start:.2f}s"
+
+        start = time.perf_counter()
+        ArticleGraph(pd.concat([dataframe.iloc[args.slide:], newest]), RELATIONSHIPS)
+        rebuild = f"{time.perf_counter() - start:.2f}s"
+        print(f"{size:>9}{nodes:>9}{edges:>9}{legacy:>10}{bulk:>10}{slide:>10}{rebuild:>10}")
+
+
+if __name__ == "__main__":
+    main()
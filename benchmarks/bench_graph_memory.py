@@ -0,0 +1,75 @@
+"""
+Memory and query time of the networkx graph of ArticleGraph against the arrays of CompactGraph,
+on the synthetic articles of bench_graph.
+Memory is the size of the objects allocated by the build and still alive after it, measured with tracemalloc
+(the dataframe of the articles is allocated before and not counted). Queries are the degree and the 10 heaviest
+neighbors of --queries random nodes, and the 10 most frequent persons.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_graph_memory
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.bench_graph import RELATIONSHIPS, synthetic_articles
+from news_mapping.graph.compact import CompactGraph
+from news_mapping.graph.graph import ArticleGraph
+
+
+def build_memory(graph_class, dataframe) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    graph = graph_class(dataframe, RELATIONSHIPS)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return graph, retained / 2 ** 20
+
+
+def networkx_queries(graph: ArticleGraph, nodes: list):
+    for node in nodes:
+        graph.G.degree(node)
+        sorted(graph.G[node].items(), key=lambda item: -item[1]["weight"])[:10]
+    persons = {n: f for n, f in graph.node_frequencies.items() if graph.G.nodes[n]["type"] == "persons"}
+    sorted(persons.items(), key=lambda item: -item[1])[:10]
+
+
+def compact_queries(graph: CompactGraph, nodes: list):
+    for node in nodes:
+        graph.degree(node)
+        graph.neighbors(node, k=10)
+    graph.top_k(10, by="frequency", node_type="persons")
+
+
+def timed(func, graph, nodes) -> float:
+    start = time.perf_counter()
+    func(graph, nodes)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9}{'backend':>10}{'memory':>11}{'queries':>10}")
+    for size in args.sizes:
+        dataframe = synthetic_articles(size)
+        graph, memory = build_memory(ArticleGraph, dataframe)
+        rng = np.random.default_rng(0)
+        nodes = list(rng.choice(np.array(list(graph.G.nodes), dtype=object), size=args.queries))
+        print(f"{size:>9}{'networkx':>10}{memory:>9.1f}MB{timed(networkx_queries, graph, nodes):>9.3f}s")
+        del graph
+
+        graph, memory = build_memory(CompactGraph, dataframe)
+        print(f"{size:>9}{'compact':>10}{memory:>9.1f}MB{timed(compact_queries, graph, nodes):>9.3f}s")
+        del graph
+
+
+if __name__ == "__main__":
+    main()
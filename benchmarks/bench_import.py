@@ -0,0 +1,94 @@
+"""
+Cold-start cost of every entry point of news_mapping, measured with python -X importtime in a fresh interpreter.
+For every module it reports the cumulative import time (best of --repeat runs), the time spent in the
+third-party packages it pulled in, and which of the heavy optional dependencies were loaded at import.
+None of them should be: they are imported on first use.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_import
+"""
+import argparse
+import subprocess
+import sys
+
+ENTRY_POINTS = [
+    "news_mapping.text_analysis.text_analysis",
+    "news_mapping.clustering.clustering",
+    "news_mapping.clustering.embeddings",
+    "news_mapping.clustering.incremental",
+    "news_mapping.data.scraper",
+    "news_mapping.data.fetcher",
+    "news_mapping.data.extractor",
+    "news_mapping.data.llm",
+    "news_mapping.graph.graph",
+    "news_mapping.graph.compact",
+]
+HEAVY = [
+    "gensim", "sklearn", "hdbscan", "scipy", "groq", "bs4", "serpapi", "tiktoken", "lxml", "networkx",
+    "matplotlib", "requests",
+]
+CORE = ["numpy", "pandas"]
+
+
+def parse_importtime(stderr: str) -> list:
+    """
+    :param stderr: output of python -X importtime, children printed before their parent, indented by depth
+    :return: tree of the imports, list of (name, cumulative seconds, children) at depth 0
+    """
+    pending = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        node = (name.strip(), int(cumulative) / 1e6, pending.pop(depth + 1, []))
+        pending.setdefault(depth, []).append(node)
+    return pending.get(0, [])
+
+
+def import_times(module: str) -> dict:
+    """
+    :param module: module imported in a fresh interpreter
+    :return: dict from the module, every top-level package it imported and the "core" and "heavy" groups of
+        packages to their cumulative import time in seconds, a package (or group) counting from the outermost
+        of its modules, so that nested imports are not counted twice
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    tree = parse_importtime(result.stderr)
+    times = {module: sum(seconds for name, seconds, _ in tree if name.split(".")[0] == module.split(".")[0])}
+
+    def visit(nodes, path):
+        for name, seconds, children in nodes:
+            package = name.split(".")[0]
+            group = "core" if package in CORE else "heavy" if package in HEAVY else None
+            for key in [package, group]:
+                if key is not None and key not in path:
+                    times[key] = times.get(key, 0) + seconds
+            visit(children, path | {package, group})
+
+    visit(tree, frozenset())
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", nargs="+", default=ENTRY_POINTS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'module':<45}{'total':>8}{'core':>8}{'heavy':>8}  heavy packages loaded")
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        best = min(runs, key=lambda times: times[module])
+        loaded = {name: best[name] for name in HEAVY if name in best}
+        print(
+            f"{module:<45}{best[module]:>7.2f}s{best.get('core', 0):>7.2f}s{best.get('heavy', 0):>7.2f}s  "
+            + (", ".join(f"{name} {t:.2f}s" for name, t in loaded.items()) or "-")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Peak memory of NewsProcess.process_articles, in memory against streaming (chunk_size), for a growing number
+of articles. Pages are served by a local HTTP stub and completions by a stub LLM endpoint (GROQ_BASE_URL),
+every run happens in a fresh process and reports its peak RSS and the peak of the Python allocations (tracemalloc).
+The streaming peak should stay flat as the number of articles grows.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_memory
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from benchmarks.bench_extraction import make_handler as make_llm_handler
+
+PARAGRAPHS = 400
+
+
+def make_page_handler():
+    class PageHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            article = self.path.rsplit("/", 1)[-1]
+            page = (
+                f"<html><head><title>Articolo {article}</title></head><body><article><h1>Articolo {article}</h1>"
+                + "".join(
+                    f"<p>Paragrafo {j} dell'articolo {article} sulle elezioni europee e sul voto.</p>"
+                    for j in range(PARAGRAPHS)
+                )
+                + "</article></body></html>"
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, *args):
+            pass
+
+    return PageHandler
+
+
+def worker(args):
+    from news_mapping.text_analysis.text_analysis import NewsProcess
+
+    dataframe = pd.DataFrame({
+        "title": [f"Articolo {i}" for i in range(args.articles)],
+        "newspaper": [f"Giornale {i % 10}" for i in range(args.articles)],
+        "link": [f"http://127.0.0.1:{args.page_port}/articolo/{i}" for i in range(args.articles)],
+        "date": pd.Timestamp("2024-06-01"),
+    })
+    process = NewsProcess(
+        "elezioni europee", "stub", "stub", sources=[], requests_per_minute=None, max_in_flight=16,
+    )
+    tracemalloc.start()
+    start = time.perf_counter()
+    sys.stdout = open(os.devnull, "w")
+    output = process.process_articles(dataframe, cluster_with_llm=True, chunk_size=args.chunk_size or None)
+    sys.stdout = sys.__stdout__
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    print(json.dumps({"rows": len(output), "rss": rss, "python": peak, "seconds": elapsed}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[250, 500, 1000])
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--worker", action="store_true")
+    parser.add_argument("--articles", type=int)
+    parser.add_argument("--page-port", type=int)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    page_server = ThreadingHTTPServer(("127.0.0.1", 0), make_page_handler())
+    llm_server = ThreadingHTTPServer(("127.0.0.1", 0), make_llm_handler(0.01))
+    for server in [page_server, llm_server]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = dict(os.environ, GROQ_BASE_URL=f"http://127.0.0.1:{llm_server.server_address[1]}")
+
+    print(f"{'articles':>9}{'mode':>12}{'peak RSS':>12}{'peak python':>14}{'time':>9}")
+    for size in args.sizes:
+        for chunk_size, mode in [(0, "in memory"), (args.chunk_size, f"chunks {args.chunk_size}")]:
+            result = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_memory", "--worker", "--articles", str(size),
+                 "--chunk-size", str(chunk_size), "--page-port", str(page_server.server_address[1])],
+                env=env, capture_output=True, text=True, check=True,
+            )
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(
+                f"{size:>9}{mode:>12}{stats['rss'] / 2 ** 20:>10.0f}MB{stats['python'] / 2 ** 20:>12.0f}MB"
+                f"{stats['seconds']:>8.1f}s"
+            )
+
+    page_server.shutdown()
+    llm_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Per-call overhead of token counting: loading the encoder on every call (previous calculate_token)
+against the cached encoder, and a loop of calculate_token against the batched calculate_tokens.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_tokens
+"""
+import argparse
+import time
+
+import tiktoken
+
+from news_mapping.text_analysis.utils import calculate_token, calculate_tokens
+
+TEXT = "Le elezioni europee del 2024 si sono svolte tra il 6 e il 9 giugno in tutti gli stati membri. "
+
+
+def calculate_token_uncached(string: str) -> int:
+    enc = tiktoken.get_encoding("o200k_base")
+    return len(enc.encode(string))
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--short", type=int, default=1, help="sentences per string in the per-call test")
+    parser.add_argument("--long", type=int, default=50, help="sentences per string in the batch test")
+    args = parser.parse_args()
+
+    calculate_token(TEXT)  # load the encoder once, the first load is not what is measured
+    short = [TEXT * args.short] * args.calls
+    long = [TEXT * args.long] * args.calls
+
+    uncached = timed(lambda: [calculate_token_uncached(s) for s in short])
+    cached = timed(lambda: [calculate_token(s) for s in short])
+    print(f"{args.calls} short strings")
+    print(f"  encoder per call: {uncached / args.calls * 1e6:8.1f} us/call")
+    print(f"  cached encoder:   {cached / args.calls * 1e6:8.1f} us/call")
+
+    loop = timed(lambda: [calculate_token(s) for s in long])
+    batch = timed(calculate_tokens, long)
+    print(f"{args.calls} long strings")
+    print(f"  calculate_token loop: {loop:.3f}s")
+    print(f"  calculate_tokens:     {batch:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,32 @@
-from gensim.models import Word2Vec
-from sklearn.cluster import KMeans
-from groq import Groq
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
-import hdbscan
 import numpy as np
-from collections import Counter
 
 from news_mapping.text_analysis.utils import (
+    calculate_tokens,
     evaluate_string,
     extract_inside_braces)
 
-from news_mapping.clustering.utils import replace_values_from_dict
+from news_mapping.clustering.embeddings import Word2VecEmbedder
+from news_mapping.data.cache import SQLiteCache
+from news_mapping.data.llm import chat_completion
+from news_mapping.data.rate_limiter import RateLimiter
+from news_mapping.data.wrangler import pack_batches
+
+# sklearn and hdbscan take seconds to import, so they are imported by the functions using them
 
 
 
-def vectorize_topics(topics: list):
+def vectorize_topics(topics: list, embedder=None):
     """
-    Convert a list of topics into vectors using Word2Vec.
+    Convert a list of topics into vectors, by averaging the word vectors of each topic.
+    The default embedder trains a Word2Vec on the topics themselves.
     """
-    # Train Word2Vec on topics
-    word2vec_model = Word2Vec(sentences=[topic.split() for topic in topics], vector_size=100, window=5, min_count=1,
-                              workers=4)
-
-    # Vectorize each topic by averaging word vectors
-    topic_vectors = np.array([word2vec_model.wv[topic.split()].mean(axis=0) for topic in topics])
-
-    return topic_vectors
+    embedder = embedder or Word2VecEmbedder()
+    return embedder.embed(topics)
 
 
 def kmeans_clustering(topic_vectors, num_clusters):
@@ -39,6 +40,8 @@ def kmeans_clustering(topic_vectors, num_clusters):
     Returns:
         cluster_labels: The K-means cluster labels for each topic.
     """
+    from sklearn.cluster import KMeans
+
     kmeans = KMeans(n_clusters=num_clusters, random_state=42)
     cluster_labels = kmeans.fit_predict(topic_vectors)
     return cluster_labels
@@ -54,12 +57,14 @@ def hdbscan_clustering(topic_vectors):
     Returns:
         cluster_labels: The HDBSCAN cluster labels for each topic.
     """
+    import hdbscan
+
     clusterer = hdbscan.HDBSCAN(min_cluster_size=2)
     cluster_labels = clusterer.fit_predict(topic_vectors)
     return cluster_labels
 
 
-def cluster_topics(dataframe: pd.DataFrame, topics: list = None):
+def cluster_topics(dataframe: pd.DataFrame, topics: list = None, embedder=None):
     """
     Perform clustering on the topics using K-means if topics are provided, else HDBSCAN.
     When topics are provided, force them to become the centroids for clustering.
@@ -67,23 +72,26 @@ def cluster_topics(dataframe: pd.DataFrame, topics: list = None):
     Args:
         dataframe: A pandas dataframe containing the topics column.
         topics: A list of predefined topics to determine the number of clusters for K-means (optional).
+        embedder: Embedding backend of the topics, Word2VecEmbedder or PretrainedEmbedder (optional).
 
     Returns:
         dataframe: The updated dataframe with clustered topics.
     """
-    # Step 1: Vectorize the topics
+    # Step 1: Vectorize the topics, together with the predefined ones so they share the same space
     topic_list = dataframe['topics'].tolist()
-    topic_vectors = np.array(vectorize_topics(topic_list))  # Assumed to be a function that returns vectorized topics
+    all_topic_vectors = vectorize_topics(topic_list + list(topics or []), embedder)
+    topic_vectors = all_topic_vectors[:len(topic_list)]
 
     # Step 2: Check if predefined topics are provided
     if topics:
-        # Vectorize predefined topics
-        predefined_vectors = np.array(vectorize_topics(topics))  # Vectorize predefined topics as well
+        predefined_vectors = all_topic_vectors[len(topic_list):]
 
         # Combine predefined topics with original topics
         all_vectors = np.concatenate((topic_vectors, predefined_vectors), axis=0)
 
         # Perform K-means clustering using predefined topics as initial centroids
+        from sklearn.cluster import KMeans
+
         num_clusters = len(topics)
         kmeans = KMeans(n_clusters=num_clusters, init=predefined_vectors,
                         n_init=1)  # Use predefined topics as centroids
@@ -95,69 +103,287 @@ def cluster_topics(dataframe: pd.DataFrame, topics: list = None):
         # Use HDBSCAN clustering if no predefined topics
         dataframe['topic_cluster'] = hdbscan_clustering(topic_vectors)
 
-    # Step 3: Assign the predefined topics as the cluster representatives
-    clustered_topics = []
-    for cluster_label in sorted(dataframe['topic_cluster'].unique()):
-        if topics:
-            # Assign the predefined topic as the representative for each cluster
-            representative_topic = topics[cluster_label]
-        else:
-            # If no topics provided, find the most common topic within the cluster
-            cluster_topics = dataframe[dataframe['topic_cluster'] == cluster_label]['topics']
-            representative_topic = Counter(cluster_topics).most_common(1)[0][0]
-
-        clustered_topics.append(representative_topic)
-
-    # Map cluster labels to representative topics
-    cluster_to_topic = {label: topic for label, topic in
-                        zip(sorted(dataframe['topic_cluster'].unique()), clustered_topics)}
+    # Step 3: Assign the predefined topics, or the most common topic of each cluster, as the representatives
+    if topics:
+        cluster_to_topic = dict(enumerate(topics))
+    else:
+        cluster_to_topic = representative_topics(dataframe['topic_cluster'], dataframe['topics'])
 
     # Update 'topics' column with representative topics
     dataframe['topics'] = dataframe['topic_cluster'].map(cluster_to_topic)
 
     return dataframe
 
-def cluster_topics_with_llm(
+
+def representative_topics(labels: pd.Series, topics: pd.Series, weights: pd.Series = None) -> pd.Series:
+    """
+    Most common topic of every cluster, in a single groupby over (cluster, topic) pairs.
+    Ties are broken by the first appearance of the topic.
+
+    Args:
+        labels: The cluster label of each topic.
+        topics: The topic strings.
+        weights: The number of occurrences of each topic (optional, 1 each by default).
+
+    Returns:
+        A series from cluster label to representative topic.
+    """
+    pairs = pd.DataFrame({
+        'topic_cluster': np.asarray(labels),
+        'topics': np.asarray(topics, dtype=object),
+        'weight': 1 if weights is None else np.asarray(weights),
+    })
+    counts = pairs.groupby(['topic_cluster', 'topics'], sort=False)['weight'].sum().reset_index()
+    counts = counts.sort_values('weight', ascending=False, kind='stable')
+    return counts.drop_duplicates('topic_cluster').set_index('topic_cluster')['topics']
+
+
+def cluster_topics_scalable(
         dataframe: pd.DataFrame,
-        api_key: str,
-        model: str,
         topics: list = None,
+        embedder=None,
+        n_components: int = 10,
+        batch_size: int = 4096,
 ):
     """
+    Clustering of the topics for large corpora. Identical topic strings are embedded and clustered once,
+    weighted by their number of occurrences, then the labels are mapped back to the rows in one step.
+    With predefined topics, MiniBatchKMeans starts from their vectors as centroids; otherwise HDBSCAN runs on a
+    PCA projection of the vectors. Topics left as noise by HDBSCAN keep their own string.
+
+    Args:
+        dataframe: A pandas dataframe containing the topics column.
+        topics: A list of predefined topics to determine the number of clusters (optional).
+        embedder: Embedding backend of the topics, Word2VecEmbedder or PretrainedEmbedder (optional).
+        n_components: Number of dimensions of the projection used by HDBSCAN.
+        batch_size: Size of the mini batches of MiniBatchKMeans.
+
+    Returns:
+        dataframe: The updated dataframe with clustered topics.
     """
-    client = Groq(api_key=api_key)
+    codes, unique_topics = pd.factorize(dataframe['topics'])
+    weights = np.bincount(codes, minlength=len(unique_topics))
+    vectors = vectorize_topics(list(unique_topics) + list(topics or []), embedder)
+    unique_vectors = vectors[:len(unique_topics)]
+
+    if topics:
+        from sklearn.cluster import MiniBatchKMeans
+
+        predefined_vectors = vectors[len(unique_topics):]
+        kmeans = MiniBatchKMeans(n_clusters=len(topics), init=predefined_vectors, n_init=1,
+                                 batch_size=batch_size, random_state=42)
+        kmeans.fit(np.concatenate((unique_vectors, predefined_vectors)),
+                   sample_weight=np.concatenate((weights, np.ones(len(topics)))))
+        unique_labels = kmeans.predict(unique_vectors)
+        cluster_to_topic = pd.Series(topics)
+    elif len(unique_topics) < 2:
+        unique_labels = np.zeros(len(unique_topics), dtype=int)
+        cluster_to_topic = pd.Series(unique_topics)
+    else:
+        import hdbscan
+        from sklearn.decomposition import PCA
+
+        n_components = min(n_components, unique_vectors.shape[0], unique_vectors.shape[1])
+        projected = PCA(n_components=n_components, random_state=42).fit_transform(unique_vectors)
+        unique_labels = hdbscan.HDBSCAN(min_cluster_size=2).fit_predict(projected)
+        cluster_to_topic = representative_topics(unique_labels, unique_topics, weights)
+
+    topic_representatives = np.asarray(cluster_to_topic.reindex(unique_labels), dtype=object)
+    noise = unique_labels == -1
+    topic_representatives[noise] = np.asarray(unique_topics, dtype=object)[noise]
+
+    dataframe['topic_cluster'] = unique_labels[codes]
+    dataframe['topics'] = topic_representatives[codes]
+    return dataframe
 
+
+def _llm_clustering_messages(topic_list: list, topics: list = None) -> list:
     if topics:
         topics_string = f"""The labels must belong ABSOLUTELY to one of the following labels: {topics} """
     else:
         topics_string = ""
 
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {"role": "system", "content": "You are a news analyzer"},
-            {
-                "role": "user",
-                "content": f"""
+    return [
+        {"role": "system", "content": "You are a news analyzer"},
+        {
+            "role": "user",
+            "content": f"""
     You are a news analyzer with the task of clustering similar topics of news articles.
     You have a list of topics, cluster them to put very similar topics into the same cluster.
 
 Here's the list:
 
-{dataframe["topics"].unique()}
-The output must be ONLY AND EXCLUSIVELY a json file where keys are the cluster label and the value is the list of topics 
-clustered together.
+{json.dumps(topic_list, ensure_ascii=False)}
+The output must be ONLY AND EXCLUSIVELY a json file where keys are the cluster label (a short name of the topic
+of the cluster) and the value is the list of topics clustered together.
 
     {topics_string}
 
     """,
-            },
-        ],
-        model=model,
+        },
+    ]
+
+
+def parse_llm_clusters(output: str, topic_list: list) -> dict:
+    """
+    Parse the clusters returned by the LLM, ignoring the topics that were not asked for.
+
+    Args:
+        output: The LLM output, a JSON object from cluster label to list of topics.
+        topic_list: The topics sent to the LLM.
+
+    Returns:
+        A dict from topic to cluster label, only for the topics found in the output.
+    """
+    clusters = evaluate_string(extract_inside_braces(output or ""))
+    if not isinstance(clusters, dict):
+        return {}
+    asked = set(topic_list)
+    return {
+        topic: str(label)
+        for label, members in clusters.items()
+        if isinstance(members, list)
+        for topic in members
+        if isinstance(topic, str) and topic in asked
+    }
+
+
+def chunk_topics(topic_list: list, chunk_token_budget: int, embedder=None) -> list:
+    """
+    Split a topic vocabulary into chunks that fit in a prompt, putting similar topics in the same chunk.
+    Topics are grouped with MiniBatchKMeans on their vectors, one group per chunk needed, then packed
+    group after group up to the token budget.
+
+    Args:
+        topic_list: The unique topics.
+        chunk_token_budget: Max tokens of topics in one chunk.
+        embedder: Embedding backend of the topics, Word2VecEmbedder or PretrainedEmbedder (optional).
+
+    Returns:
+        A list of chunks, each a list of topics.
+    """
+    token_counts = calculate_tokens([json.dumps(topic, ensure_ascii=False) for topic in topic_list])
+    total = sum(token_counts)
+    if total <= chunk_token_budget:
+        return [list(topic_list)]
+
+    from sklearn.cluster import MiniBatchKMeans
+
+    n_groups = min(math.ceil(total / chunk_token_budget), len(topic_list))
+    vectors = vectorize_topics(list(topic_list), embedder)
+    groups = MiniBatchKMeans(n_clusters=n_groups, n_init=1, random_state=42).fit_predict(vectors)
+    order = np.argsort(groups, kind='stable')
+    batches = pack_batches([token_counts[i] for i in order], chunk_token_budget, len(topic_list))
+    return [[topic_list[order[i]] for i in batch] for batch in batches]
+
+
+def llm_topic_mapping(
+        topic_list: list,
+        api_key: str,
+        model: str,
+        topics: list = None,
+        rate_limiter: RateLimiter = None,
+        cache: SQLiteCache = None,
+        embedder=None,
+        chunk_token_budget: int = 1500,
+        max_in_flight: int = 8,
+):
+    """
+    Cluster a topic vocabulary with the LLM, map-reduce style. The vocabulary is split into chunks of similar
+    topics that fit in a prompt, the chunks are clustered in parallel, then the cluster labels of all the chunks
+    are clustered again the same way, until a single chunk is left or the labels stop shrinking.
+    With predefined topics every chunk is already mapped to the final labels, so no merge pass is needed.
+
+    Args:
+        topic_list: The unique topics.
+        api_key: Groq API key.
+        model: The model to be used.
+        topics: A list of predefined topics the labels must belong to (optional).
+        rate_limiter: Limiter shared between LLM calls (optional).
+        cache: Optional cache of the LLM responses.
+        embedder: Embedding backend used to group similar topics in the same chunk (optional).
+        chunk_token_budget: Max tokens of topics in one prompt.
+        max_in_flight: Max number of requests waiting for the LLM at the same time.
+
+    Returns:
+        A dict from topic to cluster label, topics missing from the outputs are left out.
+    """
+    chunks = chunk_topics(topic_list, chunk_token_budget, embedder)
+
+    def cluster_chunk(chunk):
+        try:
+            output = chat_completion(
+                messages=_llm_clustering_messages(chunk, topics),
+                api_key=api_key,
+                model=model,
+                rate_limiter=rate_limiter,
+                cache=cache,
+            )
+        except Exception as e:
+            print(f"Error during Groq API call: {e}")
+            return {}
+        return parse_llm_clusters(output, chunk)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        mapping = {}
+        for chunk_mapping in executor.map(cluster_chunk, chunks):
+            mapping.update(chunk_mapping)
+
+    if len(chunks) == 1 or topics:
+        return mapping
+
+    labels = list(dict.fromkeys(mapping.get(topic, topic) for topic in topic_list))
+    if len(labels) >= len(topic_list):
+        return mapping
+
+    merged = llm_topic_mapping(
+        labels, api_key, model, rate_limiter=rate_limiter, cache=cache, embedder=embedder,
+        chunk_token_budget=chunk_token_budget, max_in_flight=max_in_flight,
     )
+    return {
+        topic: merged.get(mapping.get(topic, topic), mapping.get(topic, topic))
+        for topic in topic_list
+        if topic in mapping or mapping.get(topic, topic) in merged
+    }
+
+
+def cluster_topics_with_llm(
+        dataframe: pd.DataFrame,
+        api_key: str,
+        model: str,
+        topics: list = None,
+        rate_limiter: RateLimiter = None,
+        cache: SQLiteCache = None,
+        embedder=None,
+        chunk_token_budget: int = 1500,
+        max_in_flight: int = 8,
+):
+    """
+    Cluster the topics with the LLM. Vocabularies that do not fit in one prompt are clustered
+    chunk by chunk and merged, see llm_topic_mapping.
+
+    Args:
+        dataframe: A pandas dataframe containing the topics column.
+        api_key: Groq API key.
+        model: The model to be used.
+        topics: A list of predefined topics the labels must belong to (optional).
+        rate_limiter: Limiter shared between LLM calls (optional).
+        cache: Optional cache of the LLM responses.
+        embedder: Embedding backend used to group similar topics in the same chunk (optional).
+        chunk_token_budget: Max tokens of topics in one prompt.
+        max_in_flight: Max number of requests waiting for the LLM at the same time.
 
-    clusters = chat_completion.choices[0].message.content
-    clusters = evaluate_string(extract_inside_braces(clusters))
+    Returns:
+        dataframe: The updated dataframe with clustered topics.
+    """
+    topic_list = dataframe["topics"].unique().tolist()
+    mapping = llm_topic_mapping(
+        topic_list, api_key, model, topics, rate_limiter=rate_limiter, cache=cache, embedder=embedder,
+        chunk_token_budget=chunk_token_budget, max_in_flight=max_in_flight,
+    )
+    if len(mapping) < len(topic_list):
+        print(f"LLM clustering left {len(topic_list) - len(mapping)} topics out of {len(topic_list)} unmapped")
 
-    dataframe = replace_values_from_dict(dataframe, "topics", clusters)
+    dataframe["topics"] = dataframe["topics"].map(mapping).fillna(dataframe["topics"])
 
-    return dataframe
\ No newline at end of file
+    return dataframe
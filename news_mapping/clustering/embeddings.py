@@ -0,0 +1,123 @@
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from news_mapping.data.cache import SQLiteCache, make_key
+
+if TYPE_CHECKING:
+    from gensim.models import KeyedVectors
+
+
+def average_word_vectors(topics: list, key_to_index: dict, vectors: np.ndarray) -> np.ndarray:
+    """
+    Vectorize every topic as the mean of the vectors of its words, in one pass over all the words.
+    Words missing from the vocabulary are skipped (tried as they are, then lowercased), topics without
+    any known word get a zero vector.
+    :param topics: list of topic strings
+    :param key_to_index: vocabulary, from word to row of vectors
+    :param vectors: matrix of word vectors
+    :return: matrix with one row per topic
+    """
+    topic_index = []
+    word_index = []
+    for i, topic in enumerate(topics):
+        for word in topic.split():
+            j = key_to_index.get(word, key_to_index.get(word.lower()))
+            if j is not None:
+                topic_index.append(i)
+                word_index.append(j)
+
+    sums = np.zeros((len(topics), vectors.shape[1]), dtype=np.float32)
+    np.add.at(sums, np.array(topic_index, dtype=np.intp), vectors[np.array(word_index, dtype=np.intp)])
+    counts = np.bincount(np.array(topic_index, dtype=np.intp), minlength=len(topics))
+    return (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+
+
+class Word2VecEmbedder:
+    """
+    Word2Vec trained on the topics being embedded, so every call builds its own embedding space.
+    Embed the article topics and the predefined topics in the same call to compare them.
+    """
+
+    def __init__(self, vector_size: int = 100, window: int = 5, workers: int = 4):
+        self.vector_size = vector_size
+        self.window = window
+        self.workers = workers
+
+    def embed(self, topics: list) -> np.ndarray:
+        """
+        :param topics: list of topic strings
+        :return: matrix with one row per topic
+        """
+        from gensim.models import Word2Vec
+
+        model = Word2Vec(
+            sentences=[topic.split() for topic in topics],
+            vector_size=self.vector_size,
+            window=self.window,
+            min_count=1,
+            workers=self.workers,
+        )
+        return average_word_vectors(topics, model.wv.key_to_index, model.wv.vectors)
+
+
+class PretrainedEmbedder:
+    """
+    Pretrained word vectors loaded once per process through gensim KeyedVectors.
+    Vectors saved in gensim's native format (KeyedVectors.save) are memory-mapped, so several processes
+    share the same pages and loading is almost free. Every topic lives in the same space across runs,
+    and an optional on-disk memo keeps the vector of every topic already embedded.
+    """
+
+    _loaded = {}
+
+    def __init__(self, path: str, binary: bool = False, memo: SQLiteCache = None):
+        """
+        :param path: path of the vectors, gensim native format (.kv) or word2vec format (.bin, .txt, .vec)
+        :param binary: whether a word2vec format file is binary
+        :param memo: optional cache from topic string to vector
+        """
+        self.path = path
+        self.binary = binary
+        self.memo = memo
+
+    @property
+    def vectors(self) -> "KeyedVectors":
+        if self.path not in self._loaded:
+            from gensim.models import KeyedVectors
+
+            if self.path.endswith(".kv"):
+                self._loaded[self.path] = KeyedVectors.load(self.path, mmap="r")
+            else:
+                self._loaded[self.path] = KeyedVectors.load_word2vec_format(self.path, binary=self.binary)
+        return self._loaded[self.path]
+
+    def embed(self, topics: list) -> np.ndarray:
+        """
+        :param topics: list of topic strings
+        :return: matrix with one row per topic
+        """
+        if len(topics) == 0:
+            return np.zeros((0, self.vectors.vector_size), dtype=np.float32)
+        unique, inverse = np.unique(np.asarray(topics, dtype=object), return_inverse=True)
+        unique = unique.tolist()
+        embedded = [None] * len(unique)
+        if self.memo is not None:
+            keys = [make_key(self.path, topic) for topic in unique]
+            cached = self.memo.get_many(keys)
+            for i, key in enumerate(keys):
+                if key in cached:
+                    embedded[i] = np.frombuffer(cached[key], dtype=np.float32)
+
+        missing = [i for i, vector in enumerate(embedded) if vector is None]
+        if missing:
+            kv = self.vectors
+            computed = average_word_vectors([unique[i] for i in missing], kv.key_to_index, kv.vectors)
+            for i, vector in zip(missing, computed):
+                embedded[i] = vector
+            if self.memo is not None:
+                self.memo.set_many({
+                    keys[i]: vector.astype(np.float32).tobytes() for i, vector in zip(missing, computed)
+                })
+
+        return np.vstack(embedded)[inverse.reshape(-1)]
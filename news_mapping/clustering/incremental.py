@@ -0,0 +1,269 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from news_mapping.clustering.clustering import representative_topics, vectorize_topics
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class IncrementalTopicClusterer:
+    """
+    Persisted topic clustering model, updated with the topics of every new batch of articles
+    instead of reclustering the whole history.
+
+    The model keeps a centroid and a representative topic per cluster, and the cluster of every topic
+    string seen so far. On update, known topics are looked up and their new occurrences added to the
+    centroids, new topics are assigned to the nearest centroid when within the cosine distance threshold,
+    and only the outliers are clustered, together with the recent outliers of previous batches, to open
+    new clusters. Outliers are forgotten after max_outlier_age updates and at most max_outliers are kept,
+    so the cost of an update does not grow with the history. When the share of outliers in a batch
+    goes over drift_threshold, the whole vocabulary is clustered again from scratch.
+
+    Vectors must come from the same space across runs, so use a PretrainedEmbedder.
+    """
+
+    def __init__(
+        self,
+        embedder,
+        threshold: float = 0.3,
+        drift_threshold: float = 0.5,
+        min_cluster_size: int = 2,
+        topics: list = None,
+        max_outlier_age: int = 30,
+        max_outliers: int = 5000,
+    ):
+        """
+        :param embedder: embedding backend of the topics, with a stable space across runs (PretrainedEmbedder)
+        :param threshold: max cosine distance between a topic and the centroid of its cluster
+        :param drift_threshold: share of new topics left as outliers that triggers a full refit
+        :param min_cluster_size: min number of topics of a new cluster
+        :param topics: optional predefined topics, used as the fixed clusters; every topic goes to the nearest
+        :param max_outlier_age: number of updates after which an outlier not clustered yet is forgotten
+        :param max_outliers: max number of outliers kept, the most recent ones
+        """
+        self.embedder = embedder
+        self.threshold = threshold
+        self.drift_threshold = drift_threshold
+        self.min_cluster_size = min_cluster_size
+        self.topics = topics
+        self.max_outlier_age = max_outlier_age
+        self.max_outliers = max_outliers
+        self.updates = 0
+        self.outlier_ages = {}  # outlier topic -> update in which it was first seen
+        self.sums = None
+        self.counts = np.zeros(0)
+        self.topic_labels = {}
+        self.topic_counts = {}
+        self.outliers = {}
+        self.representatives = {}
+
+    @property
+    def centroids(self) -> np.ndarray:
+        return _normalize(self.sums)
+
+    def _embed(self, topics: list) -> np.ndarray:
+        return _normalize(np.asarray(vectorize_topics(topics, self.embedder), dtype=np.float32))
+
+    def _add_to_clusters(self, topics: list, vectors: np.ndarray, labels: np.ndarray):
+        if not topics:
+            return
+        weights = np.array([self.topic_counts[t] for t in topics], dtype=np.float32)
+        np.add.at(self.sums, labels, vectors * weights[:, None])
+        np.add.at(self.counts, labels, weights)
+        for topic, label in zip(topics, labels):
+            self.topic_labels[topic] = int(label)
+
+    def _open_clusters(self):
+        """Cluster the outliers among themselves, clusters of at least min_cluster_size topics become new ones."""
+        if len(self.outliers) < self.min_cluster_size:
+            return
+        import hdbscan
+
+        topics = list(self.outliers)
+        vectors = np.vstack([self.outliers[t] for t in topics])
+        labels = hdbscan.HDBSCAN(min_cluster_size=self.min_cluster_size).fit_predict(vectors)
+        found = sorted(set(labels) - {-1})
+        if not found:
+            return
+
+        first = self.sums.shape[0]
+        self.sums = np.vstack([self.sums, np.zeros((len(found), self.sums.shape[1]), dtype=np.float32)])
+        self.counts = np.concatenate([self.counts, np.zeros(len(found))])
+        new_labels = {label: first + i for i, label in enumerate(found)}
+        clustered = [i for i, label in enumerate(labels) if label != -1]
+        self._add_to_clusters(
+            [topics[i] for i in clustered],
+            vectors[clustered],
+            np.array([new_labels[labels[i]] for i in clustered]),
+        )
+        for i in clustered:
+            del self.outliers[topics[i]]
+            self.outlier_ages.pop(topics[i], None)
+
+    def _add_outliers(self, topics: list, vectors):
+        for topic, vector in zip(topics, vectors):
+            self.outliers[topic] = vector
+            self.outlier_ages.setdefault(topic, self.updates)
+
+    def _forget_outliers(self):
+        """Drop the outliers older than max_outlier_age updates and the oldest ones over max_outliers."""
+        by_age = sorted(self.outliers, key=lambda t: self.outlier_ages.get(t, self.updates), reverse=True)
+        keep = {
+            t for t in by_age[:self.max_outliers]
+            if self.updates - self.outlier_ages.get(t, self.updates) < self.max_outlier_age
+        }
+        for topic in [t for t in self.outliers if t not in keep]:
+            del self.outliers[topic]
+            # a forgotten topic is new again if it comes back, and does not weigh on the refits
+            self.topic_counts.pop(topic, None)
+        self.outlier_ages = {t: self.outlier_ages.get(t, self.updates) for t in self.outliers}
+
+    def _update_representatives(self):
+        if self.topics:
+            self.representatives = dict(enumerate(self.topics))
+            return
+        vocabulary = pd.Series(self.topic_labels)
+        weights = vocabulary.index.map(self.topic_counts)
+        self.representatives = representative_topics(vocabulary.values, vocabulary.index, weights).to_dict()
+
+    def fit(self, topic_counts: dict):
+        """
+        Cluster a whole vocabulary from scratch.
+        :param topic_counts: dict from topic string to number of occurrences
+        :return: the fitted model
+        """
+        self.topic_counts = dict(topic_counts)
+        self.topic_labels = {}
+        self.outliers = {}
+        self.outlier_ages = {}
+        topics = list(self.topic_counts)
+        vectors = self._embed(topics)
+
+        if self.topics:
+            predefined = self._embed(self.topics)
+            self.sums = predefined.copy()
+            self.counts = np.ones(len(self.topics))
+            self._add_to_clusters(topics, vectors, np.argmax(vectors @ predefined.T, axis=1))
+        else:
+            self.sums = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            self.counts = np.zeros(0)
+            self._add_outliers(topics, vectors)
+            self._open_clusters()
+
+        self._update_representatives()
+        return self
+
+    def update(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Assign the topics of new articles to the clusters and learn from them.
+        :param dataframe: dataframe with the topics column
+        :return: the dataframe with the topic_cluster column and the topics replaced by the representatives
+        """
+        self.updates += 1
+        counts = dataframe["topics"].value_counts()
+        new_topics = [t for t in counts.index if t not in self.topic_labels and t not in self.outliers]
+        for topic, count in counts.items():
+            self.topic_counts[topic] = self.topic_counts.get(topic, 0) + int(count)
+
+        # new occurrences of known topics move their centroids, as they weigh in topic_counts
+        known = [t for t in counts.index if t in self.topic_labels]
+        if known and self.sums is not None:
+            weights = counts[known].to_numpy(dtype=np.float32)
+            labels = np.array([self.topic_labels[t] for t in known])
+            np.add.at(self.sums, labels, self._embed(known) * weights[:, None])
+            np.add.at(self.counts, labels, weights)
+
+        if self.sums is None:
+            self.fit(self.topic_counts)
+        elif new_topics:
+            vectors = self._embed(new_topics)
+            if self.sums.shape[0]:
+                similarities = vectors @ self.centroids.T
+                nearest = np.argmax(similarities, axis=1)
+                distances = 1 - similarities[np.arange(len(new_topics)), nearest]
+                assigned = np.ones(len(new_topics), dtype=bool) if self.topics else distances <= self.threshold
+            else:
+                nearest = np.zeros(len(new_topics), dtype=int)
+                assigned = np.zeros(len(new_topics), dtype=bool)
+
+            if 1 - assigned.mean() > self.drift_threshold and len(self.topic_labels) > 0:
+                print("Topic drift detected, clustering the whole vocabulary again")
+                self.fit(self.topic_counts)
+            else:
+                self._add_to_clusters(
+                    [t for t, a in zip(new_topics, assigned) if a], vectors[assigned], nearest[assigned]
+                )
+                self._add_outliers([t for t, a in zip(new_topics, assigned) if not a], vectors[~assigned])
+                self._forget_outliers()
+                self._open_clusters()
+                self._update_representatives()
+
+        labels = dataframe["topics"].map(self.topic_labels).fillna(-1).astype(int)
+        dataframe["topic_cluster"] = labels
+        dataframe["topics"] = labels.map(self.representatives).fillna(dataframe["topics"])
+        return dataframe
+
+    def save(self, path: str):
+        """
+        :param path: path of the .npz file storing the model
+        """
+        state = {
+            "threshold": self.threshold,
+            "drift_threshold": self.drift_threshold,
+            "min_cluster_size": self.min_cluster_size,
+            "topics": self.topics,
+            "max_outlier_age": self.max_outlier_age,
+            "max_outliers": self.max_outliers,
+            "updates": self.updates,
+            "topic_labels": self.topic_labels,
+            "topic_counts": self.topic_counts,
+            "representatives": {str(k): v for k, v in self.representatives.items()},
+            "outliers": list(self.outliers),
+            "outlier_ages": [self.outlier_ages.get(t, self.updates) for t in self.outliers],
+        }
+        outliers = np.vstack(list(self.outliers.values())) if self.outliers else np.zeros((0, 0))
+        with open(path, "wb") as file:
+            np.savez_compressed(
+                file,
+                sums=self.sums,
+                counts=self.counts,
+                outlier_vectors=outliers,
+                state=np.array(json.dumps(state, ensure_ascii=False)),
+            )
+
+    @classmethod
+    def load(cls, path: str, embedder, **kwargs):
+        """
+        :param path: path of the .npz file storing the model, a new model is returned if it does not exist
+        :param embedder: embedding backend of the topics, the same used to build the model
+        :param kwargs: parameters of a new model
+        :return: the model
+        """
+        if not os.path.exists(path):
+            return cls(embedder, **kwargs)
+        with np.load(path) as data:
+            state = json.loads(str(data["state"]))
+            model = cls(
+                embedder,
+                threshold=state["threshold"],
+                drift_threshold=state["drift_threshold"],
+                min_cluster_size=state["min_cluster_size"],
+                topics=state["topics"],
+                max_outlier_age=state.get("max_outlier_age", 30),
+                max_outliers=state.get("max_outliers", 5000),
+            )
+            model.updates = state.get("updates", 0)
+            model.sums = data["sums"]
+            model.counts = data["counts"]
+            model.outliers = dict(zip(state["outliers"], data["outlier_vectors"]))
+            model.outlier_ages = dict(zip(state["outliers"], state.get("outlier_ages", [])))
+        model.topic_labels = state["topic_labels"]
+        model.topic_counts = state["topic_counts"]
+        model.representatives = {int(k): v for k, v in state["representatives"].items()}
+        return model
@@ -0,0 +1,291 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+
+def make_key(*parts) -> str:
+    """
+    Content-addressed key of the given parts.
+    :param parts: json-serializable values identifying the cached content
+    :return: sha256 hex digest
+    """
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCache:
+    """
+    Persistent key-value cache stored in a SQLite table.
+    Entries older than max_age are dropped, and the least recently used ones are evicted
+    once the total size of the values goes over max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: str = "cache",
+        max_age: float = None,
+        max_bytes: int = None,
+    ):
+        """
+        :param path: path of the SQLite database file
+        :param table: name of the table, so different caches can share the same file
+        :param max_age: seconds after which an entry is expired, None for no expiration
+        :param max_bytes: max total size of the stored values, None for no limit
+        """
+        self.path = path
+        self.table = table
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)"
+        )
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)"
+        )
+        self._connection.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_created ON {table} (created)"
+        )
+        self._connection.commit()
+        self._size = self._connection.execute(
+            f"SELECT COALESCE(SUM(size), 0) FROM {table}"
+        ).fetchone()[0]
+        self.evict()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _expired(self, created: float) -> bool:
+        return self.max_age is not None and time.time() - created > self.max_age
+
+    def get(self, key: str):
+        """
+        :param key: key of the entry
+        :return: cached value, or None if missing or expired
+        """
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT value, created FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or self._expired(row[1]):
+                self.misses += 1
+                return None
+            self._connection.execute(
+                f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value):
+        """
+        Store a value, then evict the entries over the limits.
+        :param key: key of the entry
+        :param value: str or bytes
+        """
+        size = len(value)
+        now = time.time()
+        with self._lock:
+            old = self._connection.execute(
+                f"SELECT size FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._connection.commit()
+            self._size += size - (old[0] if old else 0)
+        self.evict()
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Look up many keys with one query, through a temporary table, and mark the hits as accessed
+        with one update.
+        :param keys: keys of the entries
+        :return: dict from key to cached value, for the keys found and not expired
+        """
+        keys = list(dict.fromkeys(keys))
+        wanted = f"{self.table}_wanted"
+        with self._lock:
+            self._connection.execute(f"CREATE TEMP TABLE IF NOT EXISTS {wanted} (key TEXT PRIMARY KEY)")
+            self._connection.execute(f"DELETE FROM {wanted}")
+            self._connection.executemany(f"INSERT OR IGNORE INTO {wanted} VALUES (?)", ((k,) for k in keys))
+            rows = self._connection.execute(
+                f"SELECT key, value, created FROM {self.table} WHERE key IN (SELECT key FROM {wanted})"
+            ).fetchall()
+            found = {key: value for key, value, created in rows if not self._expired(created)}
+            self._connection.execute(
+                f"UPDATE {self.table} SET accessed = ? WHERE key IN (SELECT key FROM {wanted})", (time.time(),)
+            )
+            self._connection.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, items: dict):
+        """
+        Store many values in one transaction, then evict the entries over the limits.
+        :param items: dict from key to str or bytes value
+        """
+        if not items:
+            return
+        now = time.time()
+        wanted = f"{self.table}_wanted"
+        with self._lock:
+            self._connection.execute(f"CREATE TEMP TABLE IF NOT EXISTS {wanted} (key TEXT PRIMARY KEY)")
+            self._connection.execute(f"DELETE FROM {wanted}")
+            self._connection.executemany(f"INSERT OR IGNORE INTO {wanted} VALUES (?)", ((k,) for k in items))
+            replaced = self._connection.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM {self.table} WHERE key IN (SELECT key FROM {wanted})"
+            ).fetchone()[0]
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)",
+                ((key, value, len(value), now, now) for key, value in items.items()),
+            )
+            self._connection.commit()
+            self._size += sum(len(value) for value in items.values()) - replaced
+        self.evict()
+
+    def evict(self):
+        """
+        Delete expired entries and, if the cache is over max_bytes, the least recently used ones.
+        """
+        with self._lock:
+            if self.max_age is not None:
+                expired = self._connection.execute(
+                    f"DELETE FROM {self.table} WHERE created < ?", (time.time() - self.max_age,)
+                )
+                if expired.rowcount:
+                    self._size = self._connection.execute(
+                        f"SELECT COALESCE(SUM(size), 0) FROM {self.table}"
+                    ).fetchone()[0]
+            if self.max_bytes is not None and self._size > self.max_bytes:
+                rows = self._connection.execute(
+                    f"SELECT key, size FROM {self.table} ORDER BY accessed"
+                )
+                to_delete = []
+                for key, size in rows:
+                    if self._size <= self.max_bytes:
+                        break
+                    to_delete.append((key,))
+                    self._size -= size
+                rows.close()
+                self._connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", to_delete)
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        """
+        :return: hit and miss counters, number of entries and total size of the cache.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self),
+            "bytes": self._size,
+        }
+
+    def close(self):
+        self._connection.close()
+
+
+class HTTPCache(SQLiteCache):
+    """
+    Cache of web pages keyed by URL, with the raw body compressed with zlib.
+    Within ttl a page is served without touching the network, after that it is revalidated with
+    a conditional GET (If-None-Match / If-Modified-Since) and the stored body is reused on 304.
+    The text extracted from the page can be stored too, one per extractor, so a hit also skips the HTML parsing.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: str = "http",
+        ttl: float = 24 * 3600,
+        max_age: float = None,
+        max_bytes: int = None,
+        store_text: bool = True,
+    ):
+        """
+        :param path: path of the SQLite database file
+        :param table: name of the table, so different caches can share the same file
+        :param ttl: seconds during which a page is served without revalidation
+        :param max_age: seconds after which a page is dropped, None to keep revalidating it
+        :param max_bytes: max total size of the compressed pages, least recently used are evicted
+        :param store_text: whether to store the text extracted from the page as well
+        """
+        super().__init__(path, table=table, max_age=max_age, max_bytes=max_bytes)
+        self.ttl = ttl
+        self.store_text = store_text
+        self.revalidated = 0
+
+    def load(self, url: str) -> dict:
+        """
+        :param url: URL of the page
+        :return: dict with body (bytes), encoding declared by the server, etag, last_modified, fetched time and
+         texts (extractor name to text), or None
+        """
+        value = self.get(url)
+        if value is None:
+            return None
+        metadata, separator, body = zlib.decompress(value).partition(b"\0")
+        entry = json.loads(metadata)
+        if separator:
+            entry["body"] = body
+        else:
+            # older versions stored the decoded body in the JSON
+            entry["body"] = entry["body"].encode("utf-8")
+            entry["encoding"] = "utf-8"
+        # the text stored by older versions does not say which extractor produced it
+        entry.pop("text", None)
+        entry.setdefault("texts", {})
+        return entry
+
+    def save(self, url: str, entry: dict):
+        """
+        :param url: URL of the page
+        :param entry: dict as returned by load
+        """
+        # the JSON of the metadata escapes NUL characters, so the first one separates it from the body
+        metadata = json.dumps({key: value for key, value in entry.items() if key != "body"})
+        self.set(url, zlib.compress(metadata.encode("utf-8") + b"\0" + entry["body"]))
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["fetched"] <= self.ttl
+
+    @staticmethod
+    def conditional_headers(entry: dict) -> dict:
+        """
+        :param entry: cached entry of the page, or None
+        :return: headers of the conditional GET revalidating the entry
+        """
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def revalidate(self, url: str, entry: dict):
+        """
+        Mark the cached page as fresh again, after a 304 response.
+        :param url: URL of the page
+        :param entry: cached entry of the page
+        """
+        entry["fetched"] = time.time()
+        self.save(url, entry)
+        self.revalidated += 1
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["revalidated"] = self.revalidated
+        return stats
@@ -0,0 +1,175 @@
+import re
+import unicodedata
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import numpy as np
+import pandas as pd
+
+NON_WORD = re.compile(r"[\W_]+")
+TRACKING_PARAMS = re.compile(r"^(utm_|fbclid|gclid|ref$|output$|amp$)")
+AMP_SUFFIX = re.compile(r"(/amp|\.amp)$")
+HASH_SHIFT = np.uint64(32)
+
+
+def normalize_text(text: str) -> str:
+    """
+    :param text: title or text of the article
+    :return: text without accents, punctuation and case, words separated by single spaces
+    """
+    if not isinstance(text, str):
+        return ""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return NON_WORD.sub(" ", text).strip()
+
+
+def canonical_link(link: str) -> str:
+    """
+    :param link: url of the article
+    :return: url without scheme, www, tracking parameters and AMP suffixes, for exact matching
+    """
+    if not isinstance(link, str):
+        return ""
+    parts = urlsplit(link.strip())
+    host = parts.netloc.lower().removeprefix("www.").removeprefix("amp.")
+    path = AMP_SUFFIX.sub("", parts.path.rstrip("/"))
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if not TRACKING_PARAMS.match(k)])
+    return f"{host}{path}?{query}" if query else f"{host}{path}"
+
+
+def _components(n: int, pairs) -> np.ndarray:
+    """Connected components of n items linked by pairs, labeled by their first item."""
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+    return np.array([find(i) for i in range(n)], dtype=np.int64)
+
+
+def _same_key_pairs(keys: pd.Series):
+    """Pairs linking every item to the first item with the same non-empty key."""
+    first = pd.Series(np.arange(len(keys)), index=keys.index).groupby(keys.values).transform("first")
+    for i, j in zip(first.values, range(len(keys))):
+        if i != j and keys.iloc[j]:
+            yield i, j
+
+
+def title_link_duplicates(dataframe: pd.DataFrame) -> np.ndarray:
+    """
+    First deduplication pass, before fetching: articles with the same normalized title or the same canonical link
+    are the same story, e.g. a wire story published by several newspapers.
+    :param dataframe: articles with the title and link columns
+    :return: for every row, the position of the first row of its duplicate cluster
+    """
+    titles = dataframe["title"].map(normalize_text)
+    links = dataframe["link"].map(canonical_link)
+    pairs = list(_same_key_pairs(titles)) + list(_same_key_pairs(links))
+    return _components(len(dataframe), pairs)
+
+
+def shingles(text: str, size: int = 5) -> set:
+    """
+    :param text: text of the article
+    :param size: number of words of a shingle
+    :return: set of hashed word shingles, a single one for texts shorter than size
+    """
+    words = normalize_text(text).split()
+    if not words:
+        return set()
+    return {
+        zlib.crc32(" ".join(words[i:i + size]).encode("utf-8"))
+        for i in range(max(len(words) - size + 1, 1))
+    }
+
+
+def jaccard(a: set, b: set) -> float:
+    """
+    :return: Jaccard similarity of two sets, 0 if both are empty
+    """
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+class MinHashLSH:
+    """
+    MinHash signatures of shingle sets and locality sensitive hashing over bands of the signatures.
+    Two texts with Jaccard similarity s share at least a band with probability 1 - (1 - s^rows)^bands,
+    the candidates are then checked on the share of equal signature values.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, seed: int = 42):
+        """
+        :param num_perm: length of the signatures
+        :param bands: number of bands, num_perm must be a multiple of it
+        :param seed: seed of the hash functions
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        rng = np.random.default_rng(seed)
+        self.bands = bands
+        self.rows = num_perm // bands
+        # full 64-bit odd multipliers and offsets, so that a * x + b wraps around and its high bits are mixed
+        self.a = rng.integers(0, 2 ** 64, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 64, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set: set) -> np.ndarray:
+        """
+        :param shingle_set: hashed shingles of a text, not empty
+        :return: MinHash signature, one value per hash function
+        """
+        x = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+        # multiply-shift hashing: (a * x + b) mod 2^64, keeping the high 32 bits
+        with np.errstate(over="ignore"):
+            hashed = (np.outer(x, self.a) + self.b) >> HASH_SHIFT
+        return hashed.min(axis=0)
+
+    def candidate_pairs(self, signatures: np.ndarray):
+        """
+        :param signatures: matrix with one signature per row
+        :return: set of pairs of rows sharing at least a band
+        """
+        pairs = set()
+        for band in range(self.bands):
+            buckets = {}
+            for i, key in enumerate(map(bytes, signatures[:, band * self.rows:(band + 1) * self.rows])):
+                buckets.setdefault(key, []).append(i)
+            for members in buckets.values():
+                pairs.update((members[0], j) for j in members[1:])
+        return pairs
+
+
+def near_duplicates(texts: list, threshold: float = 0.8, shingle_size: int = 5, num_perm: int = 128,
+                    bands: int = 16) -> np.ndarray:
+    """
+    Second deduplication pass, after fetching: articles whose texts share at least threshold of their shingles
+    are the same story. Candidate pairs are found with MinHash/LSH, then checked on the exact Jaccard similarity
+    of their shingles, so a pair below the threshold is never merged. Empty texts are never duplicates.
+    :param texts: texts of the articles
+    :param threshold: min estimated Jaccard similarity of the shingles of two duplicates
+    :param shingle_size: number of words of a shingle
+    :param num_perm: length of the MinHash signatures
+    :param bands: number of LSH bands
+    :return: for every text, the position of the first text of its duplicate cluster
+    """
+    lsh = MinHashLSH(num_perm=num_perm, bands=bands)
+    shingle_sets = [shingles(text, shingle_size) if isinstance(text, str) else set() for text in texts]
+    indexed = [i for i, s in enumerate(shingle_sets) if s]
+    if not indexed:
+        return np.arange(len(texts))
+
+    signatures = np.vstack([lsh.signature(shingle_sets[i]) for i in indexed])
+    pairs = [
+        (indexed[i], indexed[j])
+        for i, j in lsh.candidate_pairs(signatures)
+        if jaccard(shingle_sets[indexed[i]], shingle_sets[indexed[j]]) >= threshold
+    ]
+    return _components(len(texts), pairs)
@@ -0,0 +1,116 @@
+import re
+
+BOILERPLATE_TAGS = [
+    "script", "style", "noscript", "template", "iframe", "svg", "form", "button",
+    "nav", "footer", "aside",
+]
+CONTENT_TAGS = ["h1", "h2", "h3", "p", "li", "blockquote"]
+MIN_PARAGRAPH_LENGTH = 25
+MAX_LINK_DENSITY = 0.5
+WHITESPACE = re.compile(r"\s+")
+
+
+class ExtractorError(Exception):
+    """Custom exception for invalid extractor names."""
+    def __init__(self, extractor):
+        super().__init__(f"Invalid extractor: '{extractor}'. Available extractors are {list(EXTRACTORS)}.")
+        self.extractor = extractor
+
+
+def soup_extractor(html_string, encoding: str = None) -> str:
+    """
+    Whole text of the page with BeautifulSoup, navigation, ads and scripts included.
+    :param html_string: HTML of the page, as a string or as the raw bytes of the response
+    :param encoding: encoding declared by the server for the bytes, None to detect it from the page
+    :return: text of the page
+    """
+    from bs4 import BeautifulSoup
+
+    if isinstance(html_string, bytes):
+        soup = BeautifulSoup(html_string, "html.parser", from_encoding=encoding)
+    else:
+        soup = BeautifulSoup(html_string, "html.parser")
+    return soup.get_text().replace("\n", "")
+
+
+def _normalize(text: str) -> str:
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def _link_density(element) -> float:
+    text_length = len(element.text_content()) or 1
+    link_length = sum(len(a.text_content()) for a in element.iter("a"))
+    return link_length / text_length
+
+
+def _inside_content_tag(element, container) -> bool:
+    parent = element.getparent()
+    while parent is not None and parent is not container:
+        if parent.tag in CONTENT_TAGS:
+            return True
+        parent = parent.getparent()
+    return False
+
+
+def lxml_extractor(html_string, encoding: str = None) -> str:
+    """
+    Main content of the page with lxml, readability-style.
+    Scripts, styles, navigation, headers, footers and asides are dropped, then every paragraph gives points
+    to its parent (and half to its grandparent) according to its length, and the text is taken from
+    the highest scoring container only. Falls back to the whole cleaned body when no container stands out.
+    :param html_string: HTML of the page, as a string or as the raw bytes of the response
+    :param encoding: encoding declared by the server for the bytes, None to detect it from the page
+    :return: paragraphs of the article separated by new lines
+    """
+    import lxml.html
+
+    if isinstance(html_string, str):
+        html_string, encoding = html_string.encode("utf-8"), "utf-8"
+    tree = lxml.html.fromstring(html_string, parser=lxml.html.HTMLParser(encoding=encoding))
+    # the header of an article usually holds its title, only the page header is boilerplate
+    boilerplate = [f"//{tag}" for tag in BOILERPLATE_TAGS] + ["//header[not(ancestor::article)]"]
+    for element in tree.xpath("|".join(boilerplate)):
+        element.drop_tree()
+
+    scores = {}
+    for paragraph in tree.iter("p"):
+        length = len(_normalize(paragraph.text_content()))
+        if length < MIN_PARAGRAPH_LENGTH or _link_density(paragraph) > MAX_LINK_DENSITY:
+            continue
+        parent = paragraph.getparent()
+        if parent is None:
+            continue
+        scores[parent] = scores.get(parent, 0) + length
+        grandparent = parent.getparent()
+        if grandparent is not None:
+            scores[grandparent] = scores.get(grandparent, 0) + length / 2
+
+    if not scores:
+        return _normalize(tree.text_content())
+
+    container = max(scores, key=scores.get)
+    title = tree.find(".//h1")
+    paragraphs = [_normalize(title.text_content())] if title is not None else []
+    for element in container.iter(*CONTENT_TAGS):
+        if element is title or _inside_content_tag(element, container):
+            continue
+        text = _normalize(element.text_content())
+        if text and _link_density(element) <= MAX_LINK_DENSITY:
+            paragraphs.append(text)
+    return "\n".join(paragraphs)
+
+
+EXTRACTORS = {
+    "soup": soup_extractor,
+    "lxml": lxml_extractor,
+}
+
+
+def get_extractor(extractor: str):
+    """
+    :param extractor: name of the extraction backend, one of EXTRACTORS
+    :return: callable taking the HTML of a page (and optionally the encoding of its bytes) and returning its text
+    """
+    if extractor not in EXTRACTORS:
+        raise ExtractorError(extractor)
+    return EXTRACTORS[extractor]
@@ -0,0 +1,284 @@
+import multiprocessing
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+from news_mapping.data.cache import HTTPCache
+
+DEFAULT_TIMEOUT = (5, 20)  # (connect, read) seconds
+
+
+def declared_encoding(headers) -> str:
+    """
+    :param headers: headers of the response
+    :return: charset of the Content-Type header, None when the server does not declare one
+    """
+    from requests.utils import get_encoding_from_headers
+
+    if "charset" not in headers.get("Content-Type", "").lower():
+        return None
+    return get_encoding_from_headers(headers)
+
+
+def decode_body(entry: dict) -> str:
+    """
+    :param entry: entry returned by Fetcher._fetch_entry
+    :return: body of the response as a string, decoded as requests does when the server declares no charset
+    """
+    body, encoding = entry["body"], entry["encoding"]
+    if encoding is None:
+        try:
+            return body.decode("utf-8")
+        except UnicodeDecodeError:
+            from requests.compat import chardet
+
+            encoding = chardet.detect(body)["encoding"]
+    try:
+        return body.decode(encoding or "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+def interleave_by_host(urls: list) -> list:
+    """
+    Reorder the indexes of urls so that consecutive requests hit different hosts.
+    Workers then spread over hosts instead of queueing behind the per-host limit of a single one.
+    :param urls: list of URL strings
+    :return: list of indexes of urls in round-robin order over hosts
+    """
+    queues = defaultdict(deque)
+    for i, url in enumerate(urls):
+        queues[urlparse(url).netloc].append(i)
+
+    order = []
+    while queues:
+        for host in list(queues):
+            order.append(queues[host].popleft())
+            if not queues[host]:
+                del queues[host]
+    return order
+
+
+class Fetcher:
+    """
+    Concurrent HTTP fetcher on a bounded thread pool sharing one keep-alive requests session.
+    Requests to the same host are capped by per_host_limit, and every request has a connect and read timeout,
+    so one slow host cannot stall the whole run.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 32,
+        per_host_limit: int = 4,
+        timeout: tuple = DEFAULT_TIMEOUT,
+        headers: dict = None,
+        cache: HTTPCache = None,
+    ):
+        """
+        :param max_workers: number of threads fetching at the same time
+        :param per_host_limit: max number of in-flight requests towards the same host
+        :param timeout: (connect, read) timeout in seconds
+        :param headers: optional headers sent with every request
+        :param cache: optional on-disk cache of the pages, revalidated with conditional requests
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=per_host_limit)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _host_semaphore(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_semaphores[host]
+
+    def _fetch_entry(self, url: str) -> dict:
+        """
+        Fetch a single URL, going through the cache if any.
+        :param url: URL string
+        :return: dict with the raw body of the response, its declared encoding (and the cache metadata),
+         or None if an error occurs.
+        """
+        import requests
+
+        entry = self.cache.load(url) if self.cache is not None else None
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry
+
+        try:
+            with self._host_semaphore(url):
+                response = self.session.get(
+                    url, timeout=self.timeout, headers=HTTPCache.conditional_headers(entry)
+                )
+            if response.status_code == 304 and entry is not None:
+                self.cache.revalidate(url, entry)
+                return entry
+            if response.status_code != 200:
+                print("Request not successful")
+                return None
+        except requests.RequestException as e:
+            print(f"Error during request: {e}")
+            return None
+
+        entry = {
+            # decoding is left to the parsers, it can run the charset detection of requests
+            "body": response.content,
+            "encoding": declared_encoding(response.headers),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched": time.time(),
+            "texts": {},
+        }
+        if self.cache is not None:
+            self.cache.save(url, entry)
+        return entry
+
+    def fetch(self, url: str) -> str:
+        """
+        Fetch a single URL.
+        :param url: URL string
+        :return: body of the response as a string, or None if an error occurs.
+        """
+        entry = self._fetch_entry(url)
+        return decode_body(entry) if entry is not None else None
+
+    def fetch_text(self, url: str, parse, parser: str) -> str:
+        """
+        Fetch a single URL and extract its text. When the cache stores texts, a hit skips the parsing as well.
+        :param url: URL string
+        :param parse: callable extracting the text from the raw body, taking the declared encoding (None when
+         unknown) as encoding keyword, returning None on failure
+        :param parser: name of the parser, the cache stores the text of every parser apart
+        :return: text of the page, or None if an error occurs.
+        """
+        entry = self._fetch_entry(url)
+        if entry is None:
+            return None
+        text = entry["texts"].get(parser)
+        if text is None:
+            text = parse(entry["body"], encoding=entry["encoding"])
+            if text is not None and self.cache is not None and self.cache.store_text:
+                entry["texts"][parser] = text
+                self.cache.save(url, entry)
+        return text
+
+    def _map_indexes(self, func, urls: list, progress=None) -> list:
+        results = [None] * len(urls)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(func, i): i for i in interleave_by_host(urls)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if progress:
+                    progress()
+        return results
+
+    def map(self, func, urls: list, progress=None) -> list:
+        """
+        Apply func to every URL on the thread pool.
+        :param func: callable taking a URL, typically wrapping self.fetch
+        :param urls: list of URL strings
+        :param progress: optional callable invoked with no arguments every time a URL is done (e.g. tqdm.update)
+        :return: list of results in the same order as urls
+        """
+        return self._map_indexes(lambda i: func(urls[i]), urls, progress=progress)
+
+    def fetch_and_parse(
+        self,
+        urls: list,
+        parse,
+        parser: str,
+        parse_workers: int = None,
+        queue_size: int = 64,
+        progress=None,
+    ) -> list:
+        """
+        Fetch every URL on the thread pool and parse the pages on a process pool, so parsing uses every core
+        while the threads keep waiting on the network.
+        At most queue_size pages wait for or are being parsed at the same time: when the parsers fall behind,
+        the fetching threads block, which caps the memory used by raw pages on large crawls.
+        The parsing processes are started with forkserver (spawn where it is not available) rather than forked
+        from this multi-threaded process, so the caller needs the if __name__ == "__main__" guard.
+        :param urls: list of URL strings
+        :param parse: picklable callable extracting the text from the raw body, taking the declared encoding
+         (None when unknown) as encoding keyword, returning None on failure
+        :param parser: name of the parser, the cache stores the text of every parser apart
+        :param parse_workers: number of parsing processes, default is the number of cores
+        :param queue_size: max number of fetched pages waiting for or being parsed
+        :param progress: optional callable invoked with no arguments every time a URL is done (e.g. tqdm.update)
+        :return: list of texts (None for failures) in the same order as urls
+        """
+        results = [None] * len(urls)
+        slots = threading.BoundedSemaphore(queue_size)
+        progress_lock = threading.Lock()
+
+        def done(i, text):
+            results[i] = text
+            if progress:
+                with progress_lock:
+                    progress()
+
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with ProcessPoolExecutor(
+            max_workers=parse_workers, mp_context=multiprocessing.get_context(start_method)
+        ) as parse_pool:
+
+            def fetch_stage(i):
+                url = urls[i]
+                entry = self._fetch_entry(url)
+                if entry is None or entry["texts"].get(parser) is not None:
+                    done(i, entry["texts"][parser] if entry else None)
+                    return
+
+                slots.acquire()
+                future = parse_pool.submit(parse, entry["body"], encoding=entry["encoding"])
+
+                def parse_stage(future):
+                    slots.release()
+                    try:
+                        text = future.result()
+                    except Exception as e:
+                        print(f"Error during HTML parsing: {e}")
+                        text = None
+                    if text is not None and self.cache is not None and self.cache.store_text:
+                        entry["texts"][parser] = text
+                        self.cache.save(url, entry)
+                    entry.clear()  # the future keeps this callback, release the raw page
+                    done(i, text)
+
+                future.add_done_callback(parse_stage)
+
+            self._map_indexes(fetch_stage, urls)
+
+        return results
+
+    def fetch_all(self, urls: list, progress=None) -> list:
+        """
+        Fetch every URL concurrently.
+        :param urls: list of URL strings
+        :param progress: optional callable invoked every time a URL is done
+        :return: list of bodies (None for failures) in the same order as urls
+        """
+        return self.map(self.fetch, urls, progress=progress)
@@ -0,0 +1,111 @@
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from news_mapping.data.cache import SQLiteCache, make_key
+from news_mapping.data.rate_limiter import RateLimiter, default_rate_limiter
+from news_mapping.text_analysis.utils import calculate_token
+
+if TYPE_CHECKING:
+    import groq
+
+PROMPT_VERSION = 1  # bump when the prompts or the parsing of the outputs change, to invalidate cached responses
+DEFAULT_RETRY_AFTER = 5  # seconds waited after a 429 without retry-after header
+
+
+@lru_cache(maxsize=None)
+def get_client(api_key: str) -> "groq.Groq":
+    """
+    Groq client shared by every call made with the same api key, so its connection pool is reused.
+    Retries are handled by chat_completion, not by the client.
+    :param api_key: api key for Groq
+    :return: Groq client
+    """
+    import groq
+
+    return groq.Groq(api_key=api_key, max_retries=0)
+
+
+def retry_after_seconds(error: "groq.RateLimitError") -> float:
+    """
+    Read the delay requested by the API from a 429 response.
+    :param error: rate limit error raised by the Groq client
+    :return: seconds to wait before the next request
+    """
+    try:
+        return float(error.response.headers.get("retry-after", DEFAULT_RETRY_AFTER))
+    except (AttributeError, TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def chat_completion(
+    messages: list,
+    api_key: str,
+    model: str,
+    max_tokens: int = None,
+    rate_limiter: RateLimiter = None,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+    cache: SQLiteCache = None,
+    usage: dict = None,
+) -> str:
+    """
+    Call the Groq chat completion API within the requests and tokens per minute quota.
+    :param messages: list of chat messages
+    :param api_key: api key for Groq
+    :param model: model adopted
+    :param max_tokens: max tokens of the completion
+    :param rate_limiter: limiter shared between calls, default is the module-level one
+    :param max_retries: number of retries after a 429 response or a transient error
+    :param backoff: seconds waited before the first retry after a transient error, doubled at each retry
+    :param cache: optional cache of the responses, keyed by model, prompt version and messages
+    :param usage: optional dict filled with "cached" (whether the answer came from the cache, without any request)
+     and "tokens" (total tokens of the request as reported by the API, 0 for a cached answer)
+    :return: content of the first choice of the completion
+    """
+    if usage is not None:
+        usage.update(cached=False, tokens=0)
+    if cache is not None:
+        key = make_key(PROMPT_VERSION, model, max_tokens, messages)
+        cached = cache.get(key)
+        if cached is not None:
+            if usage is not None:
+                usage["cached"] = True
+            return cached
+
+    # groq is imported on the first call, its import alone takes a quarter of a second
+    from groq import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+    rate_limiter = rate_limiter or default_rate_limiter
+    client = get_client(api_key)
+
+    # prompts are only tokenized when the limiter has a tokens per minute quota to enforce
+    estimated_tokens = (
+        sum(calculate_token(m["content"]) for m in messages) + (max_tokens or 0)
+        if rate_limiter.tokens_per_minute
+        else 0
+    )
+    kwargs = {"max_tokens": max_tokens} if max_tokens else {}
+
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire(estimated_tokens)
+        try:
+            completion = client.chat.completions.create(messages=messages, model=model, **kwargs)
+        except RateLimitError as e:
+            if attempt == max_retries:
+                raise
+            rate_limiter.pause(retry_after_seconds(e))
+            continue
+        except (APIConnectionError, APITimeoutError, InternalServerError):
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+            continue
+        if completion.usage and rate_limiter.tokens_per_minute:
+            rate_limiter.refund(estimated_tokens - completion.usage.total_tokens)
+        if usage is not None:
+            usage["tokens"] = completion.usage.total_tokens if completion.usage else estimated_tokens
+        content = completion.choices[0].message.content
+        if cache is not None and content is not None:
+            cache.set(key, content)
+        return content
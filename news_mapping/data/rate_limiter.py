@@ -0,0 +1,97 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket limiter on requests per minute and tokens per minute, shared by every LLM call.
+    Calls go through back to back while there is quota left and wait only for the quota to refill,
+    instead of sleeping a fixed amount of time before each request.
+    When the API answers 429, pause() blocks every caller until the retry-after delay is over.
+    """
+
+    def __init__(self, requests_per_minute: int = 30, tokens_per_minute: int = None):
+        """
+        :param requests_per_minute: max requests per minute, None for no limit
+        :param tokens_per_minute: max tokens (prompt + completion) per minute, None for no limit
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed <= 0:  # inside a pause, the buckets start refilling when it is over
+            return
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute,
+                self._requests + elapsed * self.requests_per_minute / 60,
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        wait = self._paused_until - now
+        if self.requests_per_minute and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    def acquire(self, tokens: int = 0):
+        """
+        Block until one request of the given number of tokens fits in the quota, then consume it.
+        :param tokens: estimated tokens of the request (prompt + max completion tokens)
+        """
+        if self.tokens_per_minute:
+            # a request larger than the whole bucket would otherwise wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+            time.sleep(wait)
+
+    def refund(self, tokens: int):
+        """
+        Settle the estimate made in acquire() with the actual usage of the request: give back the tokens estimated
+        but not used, or charge the tokens used beyond the estimate when tokens is negative. The bucket can then
+        go below zero, and the next calls wait until the overshoot is refilled.
+        :param tokens: estimated minus used tokens
+        """
+        if not tokens or not self.tokens_per_minute:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.tokens_per_minute, self._tokens + tokens)
+
+    def pause(self, seconds: float):
+        """
+        Stop every caller for the given time, after a 429 response, and empty the request bucket
+        so the calls resume at the sustained rate rather than in a burst.
+        The buckets do not refill during the pause.
+        :param seconds: delay requested by the API (retry-after)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._requests = min(self._requests, 0.0)
+            self._updated = max(self._updated, self._paused_until)
+
+
+default_rate_limiter = RateLimiter()
@@ -1,21 +1,36 @@
-import requests
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import pandas as pd
-from groq import Groq
-from bs4 import BeautifulSoup
-from serpapi.google_search import GoogleSearch
+
+from news_mapping.data.cache import HTTPCache, SQLiteCache, make_key
+from news_mapping.data.extractor import get_extractor
+from news_mapping.data.fetcher import DEFAULT_TIMEOUT, Fetcher
+from news_mapping.data.llm import chat_completion
+from news_mapping.data.rate_limiter import RateLimiter
 
 
 def google_news_articles(
-    api_key: str, keywords: str, limit: int = 10000, country: str = "it"
+    api_key: str,
+    keywords: str,
+    limit: int = 10000,
+    country: str = "it",
+    cache: SQLiteCache = None,
 ) -> pd.DataFrame:
     """
     :param api_key: SerpAPI key
     :param keywords: keywords to query in Google News
     :param limit: max number of articles scraped
     :param country: desired country from where articles scraped are from
+    :param cache: optional cache of the search results, its max_age is the freshness window of a search
     :return: pandas dataframe with all articles obtained with SerpAPI
     """
-    dataframe = pd.DataFrame()
+    key = make_key("google_news", keywords, country, limit)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return pd.DataFrame(json.loads(cached))
+
     params = {
         "engine": "google_news",
         "q": keywords,
@@ -23,12 +38,80 @@ def google_news_articles(
         "num": limit,
         "api_key": api_key,
     }
+    from serpapi.google_search import GoogleSearch
+
     search = GoogleSearch(params)
     results = search.get_dict()
     news_results = results["news_results"]
-    dataframe_temp = pd.DataFrame(news_results)
-    dataframe = pd.concat([dataframe, dataframe_temp]).reset_index(drop=True)
-    return dataframe
+    if cache is not None:
+        cache.set(key, json.dumps(news_results))
+    return pd.DataFrame(news_results)
+
+
+def parse_html(html_string, extractor: str = "lxml", encoding: str = None) -> str:
+    """
+    Extract the text of a web page.
+    :param html_string: HTML of the page, as a string or as the raw bytes of the response
+    :param extractor: extraction backend, "lxml" keeps only the main content, "soup" the whole text of the page
+    :param encoding: encoding declared by the server for the bytes, None to detect it from the page
+    :return: text of the page as a string, or None if an error occurs.
+    """
+    extract = get_extractor(extractor)
+    try:
+        return extract(html_string, encoding=encoding)
+    except Exception as e:
+        print(f"Error during HTML parsing: {e}")
+        return None
+
+
+def clean_text_with_llm(
+    text: str,
+    max_tokens: int = 1024,
+    model: str = "llama3-70b-8192",
+    api_key: str = None,
+    rate_limiter: RateLimiter = None,
+    cache: SQLiteCache = None,
+) -> str:
+    """
+    Remove the noise (ads, menus, etc.) from the text of a web page with Groq API.
+    :param text: text of the page
+    :param max_tokens: Maximum number of tokens for the output.
+    :param model: Model to use. Default is llama 70b 8192.
+    :param api_key: API key for Groq.
+    :param rate_limiter: limiter shared between LLM calls, default is the module-level one.
+    :param cache: optional cache of the LLM responses.
+    :return: cleaned article as a string, or an empty string if an error occurs.
+    """
+    try:
+        return chat_completion(
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Sei un estrattore e analizzatore di articoli di giornale."
+                },
+                {
+                    "role": "user",
+                    "content": f"""Il tuo compito è pulire una stringa che contiene il titolo, l'autore e l'articolo 
+                    di un sito web estratto. Il tuo obiettivo è:
+                    1. Rimuovere tutto il rumore irrilevante (annunci, pubblicità, ecc.).
+                    2. Restituire una versione pulita dell'articolo che includa solo il titolo, l'autore e il contenuto.
+                    3. Mantieni il formato come: Titolo, Autore e Corpo dell'Articolo.
+                    NON aggiungere nessun'altra parola di nessun tipo al tuo riassunto!! E' molto importante che 
+                    segui attentamente queste istruzioni.
+                    Pulisci il seguente testo: {text}
+                    """
+                }
+                ,
+            ],
+            api_key=api_key,
+            model=model,
+            max_tokens=max_tokens,
+            rate_limiter=rate_limiter,
+            cache=cache,
+        )
+    except Exception as e:
+        print(f"Error during Groq API call: {e}")
+        return ""
 
 
 def scrape_url(
@@ -37,6 +120,10 @@ def scrape_url(
     max_tokens: int = 1024,
     model: str = "llama3-70b-8192",
     api_key: str = None,
+    timeout: tuple = DEFAULT_TIMEOUT,
+    rate_limiter: RateLimiter = None,
+    cache: SQLiteCache = None,
+    extractor: str = "lxml",
 ) -> str:
     """
     Scraping function from URL link with Groq API (llama models for free without need of downloading them)
@@ -46,10 +133,16 @@ def scrape_url(
     :param max_tokens: Maximum number of tokens for the output.
     :param model: Model to use. Default is llama 70b 8192.
     :param api_key: API key for Groq.
+    :param timeout: (connect, read) timeout in seconds of the request.
+    :param rate_limiter: limiter shared between LLM calls, default is the module-level one.
+    :param cache: optional cache of the LLM responses.
+    :param extractor: extraction backend of the text, "lxml" or "soup".
     :return: Corpus of article as a string, or None if an error occurs.
     """
+    import requests
+
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=timeout)
         if response.status_code != 200:
             print("Request not successful")
             return None
@@ -57,43 +150,92 @@ def scrape_url(
         print(f"Error during request: {e}")
         return None
 
-    try:
-        html_string = response.text
-        soup = BeautifulSoup(html_string, "html.parser")
-        text = soup.get_text().replace("\n", "")
-    except Exception as e:
-        print(f"Error during HTML parsing: {e}")
+    text = parse_html(response.text, extractor=extractor)
+    if text is None:
         return None
 
     if clean_with_llm:
-        try:
-            client = Groq(api_key=api_key)
-            chat_completion = client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Sei un estrattore e analizzatore di articoli di giornale."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"""Il tuo compito è pulire una stringa che contiene il titolo, l'autore e l'articolo 
-                        di un sito web estratto. Il tuo obiettivo è:
-                        1. Rimuovere tutto il rumore irrilevante (annunci, pubblicità, ecc.).
-                        2. Restituire una versione pulita dell'articolo che includa solo il titolo, l'autore e il contenuto.
-                        3. Mantieni il formato come: Titolo, Autore e Corpo dell'Articolo.
-                        NON aggiungere nessun'altra parola di nessun tipo al tuo riassunto!! E' molto importante che 
-                        segui attentamente queste istruzioni.
-                        Pulisci il seguente testo: {text}
-                        """
-                    }
-                    ,
-                ],
-                model=model,
-                max_tokens=max_tokens,
-            )
-            return chat_completion.choices[0].message.content
-        except Exception as e:
-            print(f"Error during Groq API call: {e}")
-            return ""
+        return clean_text_with_llm(
+            text,
+            max_tokens=max_tokens,
+            model=model,
+            api_key=api_key,
+            rate_limiter=rate_limiter,
+            cache=cache,
+        )
     else:
         return text
+
+
+def scrape_urls(
+    urls: list,
+    clean_with_llm: bool = False,
+    max_tokens: int = 1024,
+    model: str = "llama3-70b-8192",
+    api_key: str = None,
+    max_workers: int = 32,
+    per_host_limit: int = 4,
+    timeout: tuple = DEFAULT_TIMEOUT,
+    progress=None,
+    rate_limiter: RateLimiter = None,
+    cache: SQLiteCache = None,
+    http_cache: HTTPCache = None,
+    extractor: str = "lxml",
+    parse_workers: int = None,
+    parse_queue_size: int = 64,
+) -> list:
+    """
+    Concurrent version of scrape_url over a list of URLs, sharing one pooled keep-alive session.
+    :param urls: list of URL strings of articles to scrape.
+    :param clean_with_llm: Boolean indicating whether to clean the text with Groq API.
+    :param max_tokens: Maximum number of tokens for the output.
+    :param model: Model to use. Default is llama 70b 8192.
+    :param api_key: API key for Groq.
+    :param max_workers: number of URLs scraped at the same time.
+    :param per_host_limit: max number of in-flight requests towards the same host.
+    :param timeout: (connect, read) timeout in seconds of each request.
+    :param progress: optional callable invoked with no arguments every time a URL is done (e.g. tqdm.update).
+    :param rate_limiter: limiter shared between LLM calls, default is the module-level one.
+    :param cache: optional cache of the LLM responses.
+    :param http_cache: optional on-disk cache of the pages and of their extracted text.
+    :param extractor: extraction backend of the text, "lxml" or "soup".
+    :param parse_workers: when set, pages are parsed by this many processes instead of the fetching threads.
+    :param parse_queue_size: max number of fetched pages waiting for a parsing process.
+    :return: list with the corpus of each article (None for failures), in the same order as urls.
+    """
+    get_extractor(extractor)  # fail fast on an invalid extractor name
+    parse = partial(parse_html, extractor=extractor)
+
+    def clean(text):
+        if text is None or not clean_with_llm:
+            return text
+        return clean_text_with_llm(
+            text,
+            max_tokens=max_tokens,
+            model=model,
+            api_key=api_key,
+            rate_limiter=rate_limiter,
+            cache=cache,
+        )
+
+    with Fetcher(
+        max_workers=max_workers, per_host_limit=per_host_limit, timeout=timeout, cache=http_cache
+    ) as fetcher:
+        if not parse_workers:
+            return fetcher.map(
+                lambda url: clean(fetcher.fetch_text(url, parse, extractor)), list(urls), progress=progress
+            )
+
+        texts = fetcher.fetch_and_parse(
+            list(urls),
+            parse,
+            extractor,
+            parse_workers=parse_workers,
+            queue_size=parse_queue_size,
+            progress=progress,
+        )
+
+    if not clean_with_llm:
+        return texts
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(clean, texts))
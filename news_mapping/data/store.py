@@ -0,0 +1,138 @@
+import json
+import sqlite3
+import threading
+
+import pandas as pd
+
+# column of every stage of the pipeline, a row has completed a stage when its column is not NULL
+STAGE_COLUMNS = {
+    "title": "TEXT",  # search
+    "newspaper": "TEXT",  # search
+    "date": "TEXT",  # search
+    "text": "TEXT",  # fetch
+    "extraction": "TEXT",  # extract, raw LLM output
+    "topic": "TEXT",  # cluster
+    "persons": "TEXT",  # resolve persons, JSON list
+}
+JSON_COLUMNS = ["persons"]
+# stages whose output depends on the configuration of the run (extractor, prompt, model, clustering...),
+# a fingerprint of the configuration is saved with every output and a stored output is only reused if it matches
+FINGERPRINTED = ["text", "extraction", "topic", "persons"]
+FINGERPRINT_COLUMNS = {f"{column}_key": "TEXT" for column in FINGERPRINTED}
+COLUMNS = {**STAGE_COLUMNS, **FINGERPRINT_COLUMNS}
+
+
+class ArticleStore:
+    """
+    Persistent table of articles keyed by link, with one column per pipeline stage, stored in SQLite.
+    Stages save their outputs as they go, so a rerun only processes the rows whose column is still NULL,
+    and every stage reads only the columns it needs.
+    """
+
+    def __init__(self, path: str, table: str = "articles"):
+        """
+        :param path: path of the SQLite database file
+        :param table: name of the table, so the store can share the file with the caches
+        """
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        columns = ", ".join(f"{name} {kind}" for name, kind in COLUMNS.items())
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (link TEXT PRIMARY KEY, {columns})")
+        # stores created before the fingerprints get the new columns, their outputs are then recomputed once
+        existing = {row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")}
+        for name, kind in COLUMNS.items():
+            if name not in existing:
+                self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+        self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    @staticmethod
+    def _check_columns(columns: list):
+        unknown = [c for c in columns if c not in COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown columns {unknown}. Available columns are {list(COLUMNS)}.")
+
+    def save(self, dataframe: pd.DataFrame):
+        """
+        Insert the rows, or update the given columns of the rows already stored. Missing values are written as NULL.
+        :param dataframe: link column and any of the stage columns and of their fingerprint columns (column_key)
+        """
+        columns = [c for c in dataframe.columns if c != "link"]
+        self._check_columns(columns)
+        values = dataframe[columns].astype(object).where(dataframe[columns].notna(), None)
+        for column in columns:
+            if column in JSON_COLUMNS:
+                values[column] = values[column].map(
+                    lambda v: None if v is None else json.dumps(list(v), ensure_ascii=False)
+                )
+            elif column == "date":
+                values[column] = values[column].map(lambda v: None if v is None else str(pd.Timestamp(v).date()))
+        rows = list(zip(dataframe["link"], *(values[c] for c in columns)))
+
+        assignments = ", ".join(f"{c} = excluded.{c}" for c in columns)
+        with self._lock:
+            self._connection.executemany(
+                f"INSERT INTO {self.table} (link, {', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * (len(columns) + 1))}) "
+                f"ON CONFLICT(link) DO UPDATE SET {assignments}",
+                rows,
+            )
+            self._connection.commit()
+
+    def load(self, columns: list, links: list = None, complete: bool = False) -> pd.DataFrame:
+        """
+        :param columns: stage columns to read, besides the link
+        :param links: only these articles, None for all of them
+        :param complete: only the rows where every column is not NULL
+        :return: dataframe with the link and the columns
+        """
+        self._check_columns(columns)
+        query = f"SELECT link, {', '.join(columns)} FROM {self.table}"
+        if complete:
+            query += " WHERE " + " AND ".join(f"{c} IS NOT NULL" for c in columns)
+        with self._lock:
+            if links is None:
+                dataframe = pd.read_sql_query(query, self._connection)
+            else:
+                # links are matched in the database through a temporary table, not a huge IN clause
+                self._connection.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (link TEXT PRIMARY KEY)")
+                self._connection.execute("DELETE FROM wanted")
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO wanted VALUES (?)", ((link,) for link in links)
+                )
+                dataframe = pd.read_sql_query(
+                    f"SELECT * FROM ({query}) WHERE link IN (SELECT link FROM wanted)", self._connection
+                )
+                # end the transaction opened by the temporary table, it would lock the file for other connections
+                self._connection.commit()
+
+        for column in columns:
+            if column in JSON_COLUMNS:
+                dataframe[column] = dataframe[column].map(lambda v: json.loads(v) if v is not None else None)
+            elif column == "date":
+                dataframe[column] = pd.to_datetime(dataframe[column])
+        return dataframe
+
+    def completed(self, column: str, links: list, fingerprint: str = None) -> dict:
+        """
+        :param column: stage column
+        :param links: articles to check
+        :param fingerprint: configuration of the stage, only the outputs saved with the same fingerprint are
+         returned. None to accept any output
+        :return: dict from link to stored value, for the articles that have completed the stage
+        """
+        if fingerprint is None:
+            stored = self.load([column], links, complete=True)
+        else:
+            stored = self.load([column, f"{column}_key"], links, complete=True)
+            stored = stored[stored[f"{column}_key"] == fingerprint]
+        return dict(zip(stored["link"], stored[column]))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,42 +1,33 @@
-import time
-from groq import Groq
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from news_mapping.data.cache import SQLiteCache
+from news_mapping.data.llm import chat_completion
+from news_mapping.data.rate_limiter import RateLimiter
+from news_mapping.text_analysis.utils import calculate_tokens, clean_json_string
 
-def obtain_topics_and_person(
-    text: str,
-    api_key: str,
-    query: str,
-    topics_to_scrape: None,
-    max_tokens: int = 1024,
-    model: str = "llama3-70b-8192",
-) -> str:
-    """
-    Retrieve topics discussed and people mentioned in the text provided
-    :param text: text of the article
-    :param api_key: api key. only grow supported so far
-    :param topics_to_scrape: to facilitate the work to LLM, a set of topics is provided a priori.
-    :param max_tokens: max tokens
-    :param model: model adopted
-    :return: the LLM call output.
-    """
-    time.sleep(
-        1.5
-    )  # to avoid reaching maximum requests per seconds and tokens per minute
-    client = Groq(api_key=api_key)
 
+def _topics_string(topics_to_scrape: list) -> str:
     if topics_to_scrape:
-        topics_string = """L'argomento deve appartenere **solamente** ad una delle seguenti categorie: {topics_to_scrape}. 
+        return f"""L'argomento deve appartenere **solamente** ad una delle seguenti categorie: {topics_to_scrape}. 
                             Se nessuno degli argomenti è correttamente riflesso nell'articolo, lascia il campo 
                            'topic' vuoto. """
-    else:
-        topics_string = ""
+    return ""
 
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {"role": "system", "content": "Sei un analista di notizie."},
-            {
-                "role": "user",
-                "content": f"""
+
+def extraction_messages(text: str, query: str, topics_to_scrape: list) -> list:
+    """
+    :param text: text of the article
+    :param query: keywords the article is about
+    :param topics_to_scrape: optional set of topics the article topic must belong to
+    :return: chat messages asking for the summary, topic and persons of one article
+    """
+    return [
+        {"role": "system", "content": "Sei un analista di notizie."},
+        {
+            "role": "user",
+            "content": f"""
 Sei un analista di notizie. Dal testo fornito, che è un articolo di notizie ottenuto tramite scraping di HTML,
 devi individuare:
 1. Il testo riguardante {query}, estraerlo dal resto delle parole  non rilevanti nella pagina web e riassumerlo in 3 righe.
@@ -47,26 +38,318 @@ Non aggiungere nessun altro commento o testo oltre all'oggetto JSON. Segui **rig
 Il risultato dovrà essere **esclusivamente** un oggetto JSON con la seguente struttura:
 
 {{
-  "text": "<string> (il testo riguardante {query} pulito dal rumore del resto del testo e riassunto in 3 righe)"
+  "text": "<string> (il testo riguardante {query} pulito dal rumore del resto del testo e riassunto in 3 righe)",
   "topic": "<string> (unico argomento principale dall'articolo, lasciarlo vuoto se nessun argomento è valido)",
   "persons": ["<string> (lista dei nomi propri di personaggi pubblici menzionati, se presenti, altrimenti lista vuota)"]
 }}
 
-{topics_string}
+{_topics_string(topics_to_scrape)}
 
 Ecco il testo: {text}.
 """,
-            },
-        ],
+        },
+    ]
+
+
+def batch_extraction_messages(articles: dict, query: str, topics_to_scrape: list) -> list:
+    """
+    :param articles: dict from article id to text of the article
+    :param query: keywords the articles are about
+    :param topics_to_scrape: optional set of topics the article topics must belong to
+    :return: chat messages asking for the summary, topic and persons of several articles at once
+    """
+    articles_string = "\n\n".join(f"### Articolo {i}\n{text}" for i, text in articles.items())
+    return [
+        {"role": "system", "content": "Sei un analista di notizie."},
+        {
+            "role": "user",
+            "content": f"""
+Sei un analista di notizie. Ti vengono forniti più articoli di notizie ottenuti tramite scraping di HTML,
+ognuno preceduto da "### Articolo <id>". Per **ciascun** articolo devi individuare:
+1. Il testo riguardante {query}, estraerlo dal resto delle parole  non rilevanti nella pagina web e riassumerlo in 3 righe.
+2. L'UNICO argomento principale discusso nell'articolo, devi essere il più specifico possibile riguardo al topic.
+3. Tutti i nomi propri di personaggi pubblici menzionati.
+Non aggiungere nessun altro commento o testo oltre all'array JSON. Segui **rigorosamente** queste istruzioni.
+
+Il risultato dovrà essere **esclusivamente** un array JSON con un oggetto per articolo, con la seguente struttura:
+
+[
+  {{
+    "id": "<string> (l'id dell'articolo)",
+    "text": "<string> (il testo riguardante {query} pulito dal rumore del resto del testo e riassunto in 3 righe)",
+    "topic": "<string> (unico argomento principale dall'articolo, lasciarlo vuoto se nessun argomento è valido)",
+    "persons": ["<string> (lista dei nomi propri di personaggi pubblici menzionati, se presenti, altrimenti lista vuota)"]
+  }}
+]
+
+{_topics_string(topics_to_scrape)}
+
+Ecco gli articoli:
+
+{articles_string}
+""",
+        },
+    ]
+
+
+def obtain_topics_and_person(
+    text: str,
+    api_key: str,
+    query: str,
+    topics_to_scrape: None,
+    max_tokens: int = 1024,
+    model: str = "llama3-70b-8192",
+    rate_limiter: RateLimiter = None,
+    cache: SQLiteCache = None,
+    usage: dict = None,
+) -> str:
+    """
+    Retrieve topics discussed and people mentioned in the text provided
+    :param text: text of the article
+    :param api_key: api key. only grow supported so far
+    :param topics_to_scrape: to facilitate the work to LLM, a set of topics is provided a priori.
+    :param max_tokens: max tokens
+    :param model: model adopted
+    :param rate_limiter: limiter shared between LLM calls, default is the module-level one
+    :param cache: optional cache of the LLM responses
+    :param usage: optional dict filled with the usage of the call, see chat_completion
+    :return: the LLM call output.
+    """
+    return chat_completion(
+        messages=extraction_messages(text, query, topics_to_scrape),
+        api_key=api_key,
         model=model,
         max_tokens=max_tokens,
+        rate_limiter=rate_limiter,
+        cache=cache,
+        usage=usage,
     )
 
-    return chat_completion.choices[0].message.content
+
+def obtain_topics_and_persons(
+    texts: list,
+    api_key: str,
+    query: str,
+    topics_to_scrape: None,
+    max_tokens: int = 1024,
+    model: str = "llama3-70b-8192",
+    rate_limiter: RateLimiter = None,
+    cache: SQLiteCache = None,
+    max_in_flight: int = 8,
+    progress=None,
+    stats: dict = None,
+) -> tuple:
+    """
+    Run obtain_topics_and_person over many articles, with at most max_in_flight requests at the same time.
+    An article whose call fails after the retries gets an empty output and its error is captured,
+    the rest of the run goes on.
+    :param texts: list of texts of the articles
+    :param api_key: api key. only grow supported so far
+    :param query: keywords the articles are about
+    :param topics_to_scrape: to facilitate the work to LLM, a set of topics is provided a priori.
+    :param max_tokens: max tokens
+    :param model: model adopted
+    :param rate_limiter: limiter shared between LLM calls, default is the module-level one
+    :param cache: optional cache of the LLM responses
+    :param max_in_flight: max number of requests waiting for the LLM at the same time
+    :param progress: optional callable invoked with no arguments every time an article is done (e.g. tqdm.update)
+    :param stats: optional dict filled with the number of requests actually sent, of answers from the cache and
+     of tokens reported by the API, as returned by obtain_topics_and_persons_batched
+    :return: list of LLM call outputs and list of errors (None when successful), in the same order as texts.
+    """
+    outputs = [""] * len(texts)
+    errors = [None] * len(texts)
+    if stats is None:
+        stats = {}
+    stats.update(articles=len(texts), requests=0, cached=0, tokens=0)
+    stats_lock = threading.Lock()
+
+    def extract(text):
+        usage = {}
+        output = obtain_topics_and_person(
+            text=text,
+            api_key=api_key,
+            query=query,
+            topics_to_scrape=topics_to_scrape,
+            max_tokens=max_tokens,
+            model=model,
+            rate_limiter=rate_limiter,
+            cache=cache,
+            usage=usage,
+        )
+        with stats_lock:
+            stats["cached" if usage["cached"] else "requests"] += 1
+            stats["tokens"] += usage["tokens"]
+        return output
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {executor.submit(extract, text): i for i, text in enumerate(texts)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                outputs[i] = future.result()
+            except Exception as e:
+                print(f"Error during Groq API call: {e}")
+                errors[i] = e
+            if progress:
+                progress()
+
+    stats["requests_per_article"] = stats["requests"] / max(len(texts), 1)
+    stats["tokens_per_article"] = stats["tokens"] / max(len(texts), 1)
+    return outputs, errors
+
+
+def pack_batches(token_counts: list, budget: int, max_batch_size: int) -> list:
+    """
+    Group consecutive articles into batches whose texts fit in a token budget.
+    An article larger than the budget makes a batch on its own.
+    :param token_counts: number of tokens of the text of every article
+    :param budget: max tokens of article text in a batch
+    :param max_batch_size: max number of articles in a batch
+    :return: list of batches, each a list of article indexes
+    """
+    batches = []
+    current = []
+    used = 0
+    for i, tokens in enumerate(token_counts):
+        if current and (used + tokens > budget or len(current) == max_batch_size):
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(i)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_output(output: str, ids) -> dict:
+    """
+    :param output: LLM output of a batched extraction, expected to contain a JSON array
+    :param ids: ids of the articles of the batch
+    :return: dict from article id to its extracted object, only for the ids found in the output
+    """
+    start = output.find("[")
+    end = output.rfind("]")
+    if start == -1 or end < start:
+        return {}
+    try:
+        items = json.loads(clean_json_string(output[start:end + 1]))
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+    return {
+        str(item["id"]): item
+        for item in items
+        if isinstance(item, dict) and str(item.get("id")) in ids
+    }
+
+
+def obtain_topics_and_persons_batched(
+    texts: list,
+    api_key: str,
+    query: str,
+    topics_to_scrape: None,
+    max_tokens: int = 300,
+    model: str = "llama3-70b-8192",
+    rate_limiter: RateLimiter = None,
+    cache: SQLiteCache = None,
+    batch_token_budget: int = 3000,
+    max_batch_size: int = 8,
+    max_in_flight: int = 8,
+    progress=None,
+) -> tuple:
+    """
+    Same as obtain_topics_and_persons, but several articles are packed in the same prompt, up to a token budget,
+    so the instructions are sent once per batch and far fewer requests are needed.
+    The LLM answers with a JSON array keyed by article id; the articles missing from an answer that cannot be
+    parsed are extracted again one by one.
+    :param texts: list of texts of the articles
+    :param api_key: api key. only grow supported so far
+    :param query: keywords the articles are about
+    :param topics_to_scrape: to facilitate the work to LLM, a set of topics is provided a priori.
+    :param max_tokens: max completion tokens per article
+    :param model: model adopted
+    :param rate_limiter: limiter shared between LLM calls, default is the module-level one
+    :param cache: optional cache of the LLM responses
+    :param batch_token_budget: max tokens of article text in one prompt
+    :param max_batch_size: max number of articles in one prompt
+    :param max_in_flight: max number of requests waiting for the LLM at the same time
+    :param progress: optional callable invoked with no arguments every time an article is done (e.g. tqdm.update)
+    :return: list of LLM outputs (one JSON object per article), list of errors (None when successful),
+     and dict with the number of requests actually sent, of answers from the cache and of tokens reported by the
+     API, in total and per article.
+    """
+    outputs = [""] * len(texts)
+    errors = [None] * len(texts)
+    batches = pack_batches(calculate_tokens(texts), batch_token_budget, max_batch_size)
+    stats = {
+        "articles": len(texts), "batches": len(batches), "requests": 0, "cached": 0, "fallbacks": 0, "tokens": 0,
+    }
+    stats_lock = threading.Lock()
+
+    def call(messages, completion_tokens):
+        usage = {}
+        output = chat_completion(
+            messages=messages,
+            api_key=api_key,
+            model=model,
+            max_tokens=completion_tokens,
+            rate_limiter=rate_limiter,
+            cache=cache,
+            usage=usage,
+        )
+        # answers from the cache are not requests, and cost no tokens
+        with stats_lock:
+            stats["cached" if usage["cached"] else "requests"] += 1
+            stats["tokens"] += usage["tokens"]
+        return output
+
+    def run_batch(batch):
+        parsed = {}
+        if len(batch) > 1:
+            articles = {str(i): texts[i] for i in batch}
+            try:
+                output = call(
+                    batch_extraction_messages(articles, query, topics_to_scrape), max_tokens * len(batch)
+                )
+                parsed = parse_batch_output(output or "", articles)
+            except Exception as e:
+                print(f"Error during Groq API call: {e}")
+
+        for i in batch:
+            if str(i) in parsed:
+                item = {k: v for k, v in parsed[str(i)].items() if k != "id"}
+                outputs[i] = json.dumps(item, ensure_ascii=False)
+            else:
+                if len(batch) > 1:
+                    with stats_lock:
+                        stats["fallbacks"] += 1
+                try:
+                    outputs[i] = call(extraction_messages(texts[i], query, topics_to_scrape), max_tokens)
+                except Exception as e:
+                    print(f"Error during Groq API call: {e}")
+                    errors[i] = e
+            if progress:
+                with stats_lock:
+                    progress()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        list(executor.map(run_batch, batches))
+
+    stats["requests_per_article"] = stats["requests"] / max(len(texts), 1)
+    stats["tokens_per_article"] = stats["tokens"] / max(len(texts), 1)
+    return outputs, errors, stats
 
 
 def summarize_text(
-    text: str, api_key: str, max_tokens: int = 200, model: str = "llama3-70b-8192"
+    text: str,
+    api_key: str,
+    max_tokens: int = 200,
+    model: str = "llama3-70b-8192",
+    rate_limiter: RateLimiter = None,
+    cache: SQLiteCache = None,
 ) -> str:
     """
     Summarizes a given piece of text using a language model.
@@ -76,14 +359,12 @@ def summarize_text(
         api_key (str): The API key for accessing the language model.
         model (str): The model to be used for summarization. Default is "gpt-4".
         max_tokens (int): The maximum number of tokens in the summary. Default is 100.
+        rate_limiter (RateLimiter): Limiter shared between LLM calls. Default is the module-level one.
+        cache (SQLiteCache): Optional cache of the LLM responses.
     Returns:
         str: The summarized text.
     """
-    time.sleep(
-        1,5
-    )  # to avoid reaching maximum requests per seconds and tokens per minute
-    client = Groq(api_key=api_key)
-    chat_completion = client.chat.completions.create(
+    return chat_completion(
         messages=[
             {"role": "system", "content": "Sei un analista di notizie."},
             {
@@ -94,8 +375,9 @@ def summarize_text(
                                fedelmente queste istruzioni. Ecco il testo: {text}""",
             },
         ],
+        api_key=api_key,
         model=model,
         max_tokens=max_tokens,
+        rate_limiter=rate_limiter,
+        cache=cache,
     )
-
-    return chat_completion.choices[0].message.content
@@ -0,0 +1,195 @@
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from news_mapping.graph.graph import ArticleGraph, relation_pairs
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+
+class CompactGraph(ArticleGraph):
+    """
+    Array-backed alternative to the networkx graph of ArticleGraph, for large graphs.
+    Node names are interned to integer ids, node types and frequencies are numpy arrays, and edges are stored
+    once as COO arrays (source id, target id, relationship code, weight) and once per direction as CSR arrays
+    for neighbor queries. Frequencies and weights are the same as in ArticleGraph, but the articles of every edge
+    are not tracked, and add_articles/remove_articles rebuild the arrays.
+    The networkx graph is only built when G is accessed, e.g. by plot_graph.
+    """
+
+    def __init__(self, dataframe, relationships, key: str = "link"):
+        """
+        :param dataframe: articles, one row per article
+        :param relationships: list of dicts with the source column, the target column and the relationship name
+        :param key: column identifying an article, used by remove_articles (the index if the column is missing)
+        """
+        self.dataframe = dataframe
+        self.relationships = relationships
+        self.key = key
+        self.node_types = self._extract_node_types()
+        self.version = 0
+        self._layouts = {}
+        self._build()
+
+    def _build(self):
+        self.version += 1
+        type_names = [t for relation in self.relationships for t in (relation["source"], relation["target"])]
+        self.type_names = list(dict.fromkeys(type_names))
+        self.relationship_names = [relation["relationship"] for relation in self.relationships]
+
+        pairs = [relation_pairs(self.dataframe, relation) for relation in self.relationships]
+        columns = [p[column] for p in pairs for column in ["source", "target"]]
+        if columns:
+            codes, names = pd.factorize(pd.concat(columns, ignore_index=True))
+        else:
+            codes, names = np.zeros(0, dtype=np.intp), pd.Index([])
+        self.index = pd.Index(names)
+        self.names = np.asarray(names, dtype=object)
+        n = len(self.index)
+
+        self.types = np.zeros(n, dtype=np.int8)
+        self.frequencies = np.zeros(n, dtype=np.int64)
+        edge_keys = []
+        edge_relationships = []
+        offset = 0
+        for r, (relation, p) in enumerate(zip(self.relationships, pairs)):
+            rows = p["row"].to_numpy(dtype=np.int64)
+            ends = {}
+            for column in ["source", "target"]:
+                ends[column] = codes[offset:offset + len(p)].astype(np.int64)
+                offset += len(p)
+                self.types[ends[column]] = self.type_names.index(relation[column])
+                # a node appearing several times in the same row counts once
+                once = np.unique(rows * max(n, 1) + ends[column]) % max(n, 1)
+                self.frequencies += np.bincount(once, minlength=n)
+
+            low = np.minimum(ends["source"], ends["target"])
+            high = np.maximum(ends["source"], ends["target"])
+            edge_keys.append(low * n + high)
+            edge_relationships.append(np.full(len(p), r, dtype=np.int8))
+
+        keys = np.concatenate(edge_keys) if edge_keys else np.zeros(0, dtype=np.int64)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        self.edge_source = (unique_keys // max(n, 1)).astype(np.int32)
+        self.edge_target = (unique_keys % max(n, 1)).astype(np.int32)
+        self.edge_weight = np.bincount(inverse, minlength=len(unique_keys)).astype(np.int32)
+        # the last relationship linking two nodes names the edge, as in ArticleGraph
+        self.edge_relationship = np.zeros(len(unique_keys), dtype=np.int8)
+        if len(keys):
+            np.maximum.at(self.edge_relationship, inverse, np.concatenate(edge_relationships))
+
+        loops = self.edge_source == self.edge_target
+        rows = np.concatenate([self.edge_source, self.edge_target[~loops]])
+        cols = np.concatenate([self.edge_target, self.edge_source[~loops]])
+        weights = np.concatenate([self.edge_weight, self.edge_weight[~loops]])
+        order = np.argsort(rows, kind="stable")
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))]).astype(np.int64)
+        self.indices = cols[order]
+        self.weights = weights[order]
+        self._G = None
+
+    @property
+    def node_frequencies(self) -> dict:
+        return dict(zip(self.index, self.frequencies.tolist()))
+
+    @property
+    def G(self) -> "nx.Graph":
+        """networkx version of the graph, built on first access."""
+        if self._G is None:
+            import networkx as nx
+
+            graph = nx.Graph()
+            graph.add_nodes_from(
+                (node, {"type": self.type_names[t]}) for node, t in zip(self.names.tolist(), self.types.tolist())
+            )
+            graph.add_edges_from(
+                (self.names[s], self.names[t], {"relationship": self.relationship_names[r], "weight": w})
+                for s, t, r, w in zip(
+                    self.edge_source.tolist(),
+                    self.edge_target.tolist(),
+                    self.edge_relationship.tolist(),
+                    self.edge_weight.tolist(),
+                )
+            )
+            self._G = graph
+        return self._G
+
+    def add_articles(self, dataframe):
+        """
+        Add a batch of articles, replacing the ones already in the graph, and rebuild the arrays.
+        :param dataframe: articles with the same columns as the ones the graph was built from
+        """
+        existing = self._article_keys(self.dataframe).isin(self._article_keys(dataframe))
+        self.dataframe = pd.concat([self.dataframe[~existing], dataframe])
+        self._build()
+
+    def remove_articles(self, links):
+        """
+        Remove articles and rebuild the arrays.
+        :param links: keys of the articles to remove
+        """
+        removed = self._article_keys(self.dataframe).isin(links)
+        if removed.any():
+            self.dataframe = self.dataframe[~removed]
+            self._build()
+
+    def number_of_nodes(self) -> int:
+        return len(self.index)
+
+    def number_of_edges(self) -> int:
+        return len(self.edge_weight)
+
+    def degree(self, node, weighted: bool = False) -> int:
+        """
+        :param node: name of the node
+        :param weighted: sum the weights of the edges instead of counting them
+        :return: degree of the node
+        """
+        i = self.index.get_loc(node)
+        if weighted:
+            return int(self.weights[self.indptr[i]:self.indptr[i + 1]].sum())
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def neighbors(self, node, k: int = None) -> list:
+        """
+        :param node: name of the node
+        :param k: only the k heaviest neighbors
+        :return: list of (neighbor name, edge weight), heaviest first
+        """
+        i = self.index.get_loc(node)
+        start, end = self.indptr[i], self.indptr[i + 1]
+        weights = self.weights[start:end]
+        order = np.argsort(-weights, kind="stable")[:k]
+        return list(zip(self.names[self.indices[start:end][order]].tolist(), weights[order].tolist()))
+
+    def top_k(self, k: int = 10, by: str = "frequency", node_type: str = None) -> pd.Series:
+        """
+        :param k: number of nodes
+        :param by: "frequency", "degree" or "weighted_degree"
+        :param node_type: only nodes of this type (a column of the relationships)
+        :return: series from node name to score, highest first
+        """
+        if by == "frequency":
+            scores = self.frequencies
+        elif by == "degree":
+            scores = np.diff(self.indptr)
+        elif by == "weighted_degree":
+            scores = np.bincount(
+                np.repeat(np.arange(len(self.index)), np.diff(self.indptr)),
+                weights=self.weights,
+                minlength=len(self.index),
+            )
+        else:
+            raise ValueError(f"Invalid ranking: '{by}'. Available rankings are 'frequency', 'degree', 'weighted_degree'.")
+
+        candidates = np.arange(len(self.index))
+        if node_type is not None:
+            candidates = candidates[self.types == self.type_names.index(node_type)]
+        k = min(k, len(candidates))
+        if k == 0:
+            return pd.Series(dtype=float)
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return pd.Series(scores[top], index=self.index[top])
@@ -1,5 +1,9 @@
-import networkx as nx
-import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+# networkx and matplotlib are imported where they are used, so the array backend (CompactGraph) and
+# headless rendering do not pay for them, pyplot is only imported to show a figure
+TRIANGLE_SHIFTS = [[-1, -1], [1, -1], [0, 1]]
 
 
 class LayoutError(Exception):
@@ -9,14 +13,41 @@ class LayoutError(Exception):
         self.layout = layout
 
 
+def relation_pairs(dataframe, relation) -> pd.DataFrame:
+    """
+    Source and target of a relationship for every row, list-valued columns (e.g. persons) exploded
+    into one pair per element. The row column is the position of the row the pair comes from,
+    and a pair repeated within the same row is kept once.
+    """
+    pairs = pd.DataFrame({
+        "row": range(len(dataframe)),
+        "source": dataframe[relation["source"]].values,
+        "target": dataframe[relation["target"]].values,
+    })
+    for column in ["source", "target"]:
+        if pairs[column].map(type).eq(list).any():
+            pairs = pairs.explode(column)
+    return pairs.dropna().drop_duplicates()
+
+
 class ArticleGraph:
-    def __init__(self, dataframe, relationships):
+    def __init__(self, dataframe, relationships, key: str = "link"):
+        """
+        :param dataframe: articles, one row per article
+        :param relationships: list of dicts with the source column, the target column and the relationship name
+        :param key: column identifying an article, used by remove_articles (the index if the column is missing)
+        """
+        import networkx as nx
+
         self.G = nx.Graph()
-        self.dataframe = dataframe
+        self.dataframe = None
         self.relationships = relationships  # Directly accept the relationships as a dict or JSON
+        self.key = key
         self.node_types = self._extract_node_types()
-        self.node_frequencies = self._calculate_node_frequencies()  # Calculate frequencies of nodes
-        self._build_graph()
+        self.node_frequencies = {}  # Frequencies of nodes, updated with the articles
+        self.version = 0  # Incremented every time the articles change, layouts are cached per version
+        self._layouts = {}
+        self.add_articles(dataframe)
 
     def _extract_node_types(self):
         node_types = set()
@@ -25,157 +56,226 @@ class ArticleGraph:
             node_types.add(relation["target"])
         return node_types
 
-    def _calculate_node_frequencies(self):
-        """Calculate the frequency of each node based on its appearance in the dataframe."""
-        node_frequencies = {}
+    def _article_keys(self, dataframe) -> pd.Series:
+        if self.key in dataframe.columns:
+            return dataframe[self.key]
+        return dataframe.index.to_series(index=dataframe.index)
 
-        # Loop through the dataframe and count occurrences of both source and target nodes
-        for _, row in self.dataframe.iterrows():
-            for relation in self.relationships:
-                source = row[relation["source"]]
-                target = row[relation["target"]]
+    def _contributions(self, dataframe) -> tuple:
+        """
+        Node frequencies and edges of a set of articles, from one deduplicated edge list per relationship.
+        The frequency of a node is, for every relationship, the number of rows the node appears in as source and
+        as target. The weight of an edge is the number of rows it appears in, and its articles are their keys.
+        When several relationships link the same two nodes, the weights add up and the last relationship
+        names the edge.
+        :return: dict from node to frequency, dict from node to type, dict from (source, target) to edge attributes
+        """
+        keys = self._article_keys(dataframe).values
+        counts = []
+        node_types = {}
+        edges = {}
+        for relation in self.relationships:
+            pairs = relation_pairs(dataframe, relation)
+            for column in ["source", "target"]:
+                counts.append(pairs.drop_duplicates(["row", column])[column].value_counts())
+                node_types.update(dict.fromkeys(pairs[column].unique(), relation[column]))
 
-                # Increment frequency for source
-                if source in node_frequencies:
-                    node_frequencies[source] += 1
-                else:
-                    node_frequencies[source] = 1
+            pairs["article"] = keys[pairs["row"].to_numpy(dtype=int)]
+            articles = pairs.groupby(["source", "target"], sort=False)["article"].agg(list)
+            for (source, target), edge_articles in articles.items():
+                key = (target, source) if (target, source) in edges else (source, target)
+                edge = edges.setdefault(key, {"weight": 0, "articles": set()})
+                edge["relationship"] = relation["relationship"]
+                edge["weight"] += len(edge_articles)
+                edge["articles"].update(edge_articles)
 
-                # Increment frequency for target
-                if target in node_frequencies:
-                    node_frequencies[target] += 1
-                else:
-                    node_frequencies[target] = 1
+        frequencies = pd.concat(counts).groupby(level=0, sort=False).sum().to_dict() if counts else {}
+        return frequencies, node_types, edges
 
-        return node_frequencies
+    def add_articles(self, dataframe):
+        """
+        Add a batch of articles to the graph, updating nodes, edge weights and frequencies in place.
+        Articles already in the graph are replaced.
+        :param dataframe: articles with the same columns as the ones the graph was built from
+        """
+        self.version += 1
+        if self.dataframe is not None:
+            existing = self._article_keys(dataframe).isin(self._article_keys(self.dataframe))
+            if existing.any():
+                self.remove_articles(self._article_keys(dataframe)[existing])
+        self.dataframe = dataframe if self.dataframe is None else pd.concat([self.dataframe, dataframe])
+
+        frequencies, node_types, edges = self._contributions(dataframe)
+        for node, frequency in frequencies.items():
+            self.node_frequencies[node] = self.node_frequencies.get(node, 0) + int(frequency)
+        self.G.add_nodes_from((node, {"type": node_type}) for node, node_type in node_types.items())
+
+        new_edges = []
+        for (source, target), data in edges.items():
+            if self.G.has_edge(source, target):
+                edge = self.G[source][target]
+                edge["relationship"] = data["relationship"]
+                edge["weight"] += data["weight"]
+                edge["articles"].update(data["articles"])
+            else:
+                new_edges.append((source, target, data))
+        self.G.add_edges_from(new_edges)
 
-    def _build_graph(self):
+    def remove_articles(self, links):
         """
-        Build the graph based on the dataframe and relationships.
+        Remove articles from the graph, e.g. the ones leaving a time window. Edge weights and node frequencies
+        are decreased by the contribution of the removed articles only; edges left without articles and nodes
+        left without occurrences are dropped.
+        :param links: keys of the articles to remove
         """
-        for _, row in self.dataframe.iterrows():
-            for relation in self.relationships:
-                source = row[relation["source"]]
-                target = row[relation["target"]]
-                relationship = relation["relationship"]
+        removed = self._article_keys(self.dataframe).isin(links)
+        if not removed.any():
+            return
+        self.version += 1
+        frequencies, _, edges = self._contributions(self.dataframe[removed])
+        self.dataframe = self.dataframe[~removed]
+
+        for (source, target), data in edges.items():
+            if not self.G.has_edge(source, target):
+                continue
+            edge = self.G[source][target]
+            edge["weight"] -= data["weight"]
+            edge["articles"].difference_update(data["articles"])
+            if edge["weight"] <= 0:
+                self.G.remove_edge(source, target)
+
+        for node, frequency in frequencies.items():
+            self.node_frequencies[node] = self.node_frequencies.get(node, 0) - int(frequency)
+            if self.node_frequencies[node] <= 0:
+                del self.node_frequencies[node]
+                if self.G.has_node(node) and self.G.degree(node) == 0:
+                    self.G.remove_node(node)
+
+    def _layout(self, graph, layout: str, cache_key) -> dict:
+        """
+        Positions of the nodes, computed once per layout, graph version and level of detail.
+        The layered and triangle layouts shift a random layout by node type.
+        """
+        key = (layout, self.version, cache_key)
+        if key in self._layouts:
+            return self._layouts[key]
+        import networkx as nx
+
+        if layout in ["random_layout", "layered_layout", "triangle_layout"]:
+            pos = nx.random_layout(graph, seed=42)
+        elif layout == "spring_layout":
+            pos = nx.spring_layout(graph, seed=42)
+        else:
+            raise LayoutError(layout)
 
-                # Add nodes with types
-                self.G.add_node(source, type=relation["source"])
-                self.G.add_node(target, type=relation["target"])
+        if layout == "layered_layout":
+            shifts = {node_type: [0, (i + 1) * 1.5] for i, node_type in enumerate(sorted(self.node_types))}
+        elif layout == "triangle_layout":
+            if len(self.node_types) > len(TRIANGLE_SHIFTS):
+                raise LayoutError(layout)
+            shifts = dict(zip(sorted(self.node_types), TRIANGLE_SHIFTS))
+        else:
+            shifts = None
+        if shifts:
+            pos = {node: xy + shifts[graph.nodes[node]["type"]] for node, xy in pos.items()}
 
-                # Add edges
-                self.G.add_edge(source, target, relationship=relationship)
+        # layouts of older versions of the graph are stale
+        self._layouts = {k: v for k, v in self._layouts.items() if k[1] == self.version}
+        self._layouts[key] = pos
+        return pos
 
     def plot_graph(self,
                    title:str = None,
                    layout: str = "random_layout",
                    figsize: tuple = (14,14),
-                   show_axis: str = "on"):
+                   show_axis: str = "on",
+                   path: str = None,
+                   max_labels: int = 50,
+                   max_edge_labels: int = 50,
+                   min_weight: int = 1,
+                   max_edges: int = None,
+                   dpi: int = 100):
         """
-                Plot the graph with node sizes based on frequency of appearance.
+        Plot the graph with node sizes based on frequency of appearance.
+        Nodes and edges are drawn as one collection each, only the max_labels most frequent nodes and the
+        max_edge_labels heaviest edges are labeled. For large graphs, min_weight and max_edges keep only the heaviest
+        edges (and the nodes they link), a level of detail that also makes the layout much cheaper to compute.
+        Layouts are cached until the articles of the graph change.
 
         :param title:
-        :param layout: ["random_layout", "spring_layout", "layered_layout"]
+        :param layout: ["random_layout", "spring_layout", "layered_layout", "triangle_layout"]
         :param figsize: tuple
         :param show_axis: ["off", "on"]
+        :param path: file to save the figure to, rendered with the non-interactive Agg backend. If None, show it
+        :param max_labels: max number of node labels, the most frequent nodes first
+        :param max_edge_labels: max number of edge labels (relationships), the heaviest edges first
+        :param min_weight: only draw the edges appearing in at least min_weight articles
+        :param max_edges: only draw the max_edges heaviest edges
+        :param dpi: resolution of the saved figure
         :return:
         """
-        plt.figure(figsize=figsize)
-        plt.grid()
+        graph = self.G
+        edges = [(u, v, d) for u, v, d in graph.edges(data=True) if d.get("weight", 1) >= min_weight]
+        if max_edges is not None and len(edges) > max_edges:
+            edges = sorted(edges, key=lambda e: -e[2].get("weight", 1))[:max_edges]
+        if min_weight > 1 or max_edges is not None:
+            graph = graph.edge_subgraph((u, v) for u, v, _ in edges)
+        pos = self._layout(graph, layout, (min_weight, max_edges))
 
-        # Position the nodes according to specified layout
-        if layout == "random_layout":
-            pos = nx.random_layout(self.G)
-        if layout == "layered_layout":
-            y = {}
-            for i, node_type in enumerate(list(self.node_types)):
-                y[node_type] = (i + 1) * 1.5
+        import matplotlib
+        from matplotlib.collections import LineCollection
 
-            for i, node in dict(self.G.nodes).items():
-                pos[i] += [0,y[node["type"]]]
-        elif layout == "spring_layout":
-            pos = nx.spring_layout(self.G)
-        elif layout == "triangle_layout":
-            shift_nt = {}
-            shifts = [[-1, -1], [1,-1], [0,1]]
-            for i, node_type in enumerate(list(self.node_types)):
-                shift_nt[node_type] = shifts[i]
-            for i, node in dict(self.G.nodes).items():
-                pos[i] += shift_nt[node["type"]]
+        if path:
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot()
         else:
-            raise LayoutError(layout)
+            import matplotlib.pyplot as plt
+
+            fig, ax = plt.subplots(figsize=figsize)
+        ax.grid()
+
+        nodes = list(graph.nodes)
+        xy = np.array([pos[node] for node in nodes]).reshape(-1, 2)
+
+        # Generate a unique color for each node type
+        node_types = sorted(self.node_types)
+        colormap = matplotlib.colormaps["tab20"].resampled(max(len(node_types), 1))
+        type_colors = {node_type: colormap(i) for i, node_type in enumerate(node_types)}
+        colors = [type_colors.get(graph.nodes[node].get("type"), "skyblue") for node in nodes]
+
+        # Scale node sizes on the frequency (number of occurrences), with a minimum size of 200
+        node_frequencies = self.node_frequencies
+        frequencies = np.array([node_frequencies.get(node, 0) for node in nodes], dtype=float)
+        max_frequency = frequencies.max() if len(frequencies) and frequencies.max() > 0 else 1
+        sizes = 200 + frequencies / max_frequency * 2000
 
+        # Draw the edges and the nodes, one collection each
+        segments = np.array([(pos[u], pos[v]) for u, v, _ in edges]).reshape(-1, 2, 2)
+        ax.add_collection(LineCollection(
+            segments, linewidths=2, alpha=0.6, colors="gray", linestyles="dashed", zorder=1
+        ))
+        ax.scatter(xy[:, 0], xy[:, 1], s=sizes, c=colors, alpha=0.9, zorder=2)
+
+        # Draw the labels of the most frequent nodes
+        for i in np.argsort(-frequencies, kind="stable")[:max_labels]:
+            ax.text(*xy[i], str(nodes[i]), fontsize=6, color="black", fontweight="bold",
+                    ha="center", va="center", zorder=3)
+
+        # Draw edge labels (relationships) of the heaviest edges
+        for u, v, d in sorted(edges, key=lambda e: -e[2].get("weight", 1))[:max_edge_labels]:
+            ax.text(*((np.asarray(pos[u]) + np.asarray(pos[v])) / 2), d.get("relationship", ""),
+                    fontsize=6, color="red", fontweight="bold", ha="center", va="center", zorder=3)
 
-        # Define default colors and shapes
-        default_color = "skyblue"
-        default_shape = "o"
-
-        # Generate a unique color and shape for each node type
-        unique_colors = plt.cm.get_cmap("tab20", len(self.node_types))
-        node_colors = {
-            node_type: unique_colors(i) for i, node_type in enumerate(self.node_types)
-        }
-        node_shapes = {node_type: default_shape for node_type in self.node_types}
-
-        # Calculate node sizes based on frequency (number of occurrences)
-        max_frequency = (
-            max(self.node_frequencies.values()) if self.node_frequencies else 1
-        )
-
-        # Scale node sizes, ensuring a minimum size of 300
-        node_sizes = {
-            node: 200 + (frequency / max_frequency) * 2000
-            for node, frequency in self.node_frequencies.items()
-        }
-
-        # Draw nodes with different colors and shapes for different types
-        for node_type in self.node_types:
-            nodelist = [
-                node
-                for node, attr in self.G.nodes(data=True)
-                if attr["type"] == node_type
-            ]
-            color = node_colors.get(node_type, default_color)
-            shape = node_shapes.get(node_type, default_shape)
-
-            # Get the sizes for the corresponding nodes
-            sizes = [
-                node_sizes.get(node, 200) for node in nodelist
-            ]  # Default to 300 if no size
-
-            nx.draw_networkx_nodes(
-                self.G,
-                pos,
-                nodelist=nodelist,
-                node_color=color,
-                node_shape=shape,
-                node_size=sizes,
-                alpha=0.9,
-            )
-
-        # Draw the edges
-        nx.draw_networkx_edges(
-            self.G, pos, width=2, alpha=0.6, edge_color="gray", style="dashed"
-        )
-
-        # Draw the labels
-        nx.draw_networkx_labels(
-            self.G, pos, font_size=6, font_color="black", font_weight="bold"
-        )
-
-        # Draw edge labels (relationships)
-        edge_labels = {(u, v): d["relationship"] for u, v, d in self.G.edges(data=True)}
-        nx.draw_networkx_edge_labels(
-            self.G,
-            pos,
-            edge_labels=edge_labels,
-            font_color="red",
-            font_size=6,
-            font_weight="bold",
-        )
-
-        # Show the plot
         graph_title = "Newspaper Articles Graph" if not title else title
-        plt.title(graph_title, fontsize=20)
-        plt.axis(show_axis)
-        plt.show()
\ No newline at end of file
+        ax.set_title(graph_title, fontsize=20)
+        ax.axis(show_axis)
+        ax.autoscale_view()
+
+        if path:
+            fig.savefig(path, dpi=dpi)
+        else:
+            plt.show()
@@ -0,0 +1,320 @@
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from difflib import SequenceMatcher
+
+import pandas as pd
+
+try:
+    from unidecode import unidecode
+except ImportError:
+    unidecode = None
+
+NON_WORD = re.compile(r"[^\w\s]+|_")
+JOINERS = re.compile(r"['’‘`-]")
+# lowercase particles that belong to the surname, e.g. "von der Leyen", "De Luca"
+SURNAME_PARTICLES = {
+    "d", "da", "dal", "dalla", "de", "dei", "del", "della", "der", "des", "di", "dos", "du", "la", "le", "lo",
+    "van", "von",
+}
+MIN_GIVEN_SIMILARITY = 0.85
+
+
+def normalize_name(name: str) -> str:
+    """
+    :param name: person name as written in the article
+    :return: name without case, accents and punctuation, e.g. "D'Alema, Massimo" -> "dalema massimo"
+    """
+    if not isinstance(name, str):
+        return ""
+    name = name.casefold()
+    if unidecode is not None:
+        name = unidecode(name)
+    else:
+        name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    name = JOINERS.sub("", name)
+    return " ".join(NON_WORD.sub(" ", name).split())
+
+
+def split_name(normalized: str) -> tuple:
+    """
+    :param normalized: name returned by normalize_name
+    :return: (tuple of given names, surname), the surname keeping its particles
+    """
+    tokens = normalized.split()
+    if not tokens:
+        return (), ""
+    start = len(tokens) - 1
+    while start > 0 and tokens[start - 1] in SURNAME_PARTICLES:
+        start -= 1
+    return tuple(tokens[:start]), " ".join(tokens[start:])
+
+
+def given_names_compatible(a: tuple, b: tuple) -> bool:
+    """
+    Given names of two persons with the same surname are compatible when one of them is missing, or the first ones
+    are the same name up to an initial or a typo.
+    """
+    if not a or not b:
+        return True
+    x, y = a[0], b[0]
+    if len(x) == 1 or len(y) == 1:
+        return x[0] == y[0]
+    return x == y or SequenceMatcher(None, x, y).ratio() >= MIN_GIVEN_SIMILARITY
+
+
+class PersonIndex:
+    """
+    Entity-resolution index of the persons mentioned in the articles.
+    Names are normalized (case, accents, punctuation) and blocked by surname, a mention is only compared with the
+    persons sharing its surname and with compatible given names ("M. Draghi", "Mario Draghi", "Draghi").
+    When several persons are compatible, e.g. a bare surname, the one co-occurring the most with the newspaper
+    and the topic of the article is chosen. Every person keeps the most complete name seen as display name.
+    Full names are stored in an alias table, so known names are resolved with a lookup, and the index is persisted
+    in SQLite across runs, with the (article link, person) pairs already counted, so that resolving the same
+    articles again does not count their mentions twice.
+    """
+
+    def __init__(self, path: str = None, table: str = "persons"):
+        """
+        :param path: path of the SQLite database file, None to keep the index in memory only
+        :param table: prefix of the tables, so the index can share the file with the caches and the store
+        """
+        self.path = path
+        self.table = table
+        self.entities = {}  # id -> name, given, surname, mentions, newspapers, topics
+        self.aliases = {}  # normalized full name -> id
+        self.blocks = {}  # surname -> ids
+        self._dirty = set()
+        self._new_aliases = {}
+        self._observed = set()  # (link, id) counted and not saved yet, all of them without a database
+        self._lock = threading.Lock()
+        self._connection = None
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}_entities (id INTEGER PRIMARY KEY, name TEXT, given TEXT, "
+                f"surname TEXT, mentions INTEGER, newspapers TEXT, topics TEXT)"
+            )
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}_aliases (alias TEXT PRIMARY KEY, entity INTEGER)"
+            )
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}_observed (link TEXT, entity INTEGER, PRIMARY KEY (link, entity))"
+            )
+            self._connection.commit()
+            self._load()
+        self._next_id = max(self.entities, default=0) + 1
+
+    def __len__(self):
+        return len(self.entities)
+
+    def _load(self):
+        for entity, name, given, surname, mentions, newspapers, topics in self._connection.execute(
+                f"SELECT id, name, given, surname, mentions, newspapers, topics FROM {self.table}_entities"
+        ):
+            self.entities[entity] = {
+                "name": name,
+                "given": tuple(json.loads(given)),
+                "surname": surname,
+                "mentions": mentions,
+                "newspapers": Counter(json.loads(newspapers)),
+                "topics": Counter(json.loads(topics)),
+            }
+            self.blocks.setdefault(surname, []).append(entity)
+        self.aliases.update(self._connection.execute(f"SELECT alias, entity FROM {self.table}_aliases"))
+
+    def save(self):
+        """
+        Write the persons and the aliases added or changed since the last save.
+        """
+        if self._connection is None:
+            return
+        with self._lock:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table}_entities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        entity, e["name"], json.dumps(e["given"]), e["surname"], e["mentions"],
+                        json.dumps(e["newspapers"], ensure_ascii=False), json.dumps(e["topics"], ensure_ascii=False),
+                    )
+                    for entity, e in ((entity, self.entities[entity]) for entity in self._dirty)
+                ),
+            )
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table}_aliases VALUES (?, ?)", self._new_aliases.items()
+            )
+            self._connection.executemany(
+                f"INSERT OR IGNORE INTO {self.table}_observed VALUES (?, ?)", self._observed
+            )
+            self._connection.commit()
+            self._dirty.clear()
+            self._new_aliases.clear()
+            self._observed.clear()
+
+    def close(self):
+        if self._connection is not None:
+            self.save()
+            with self._lock:
+                self._connection.close()
+
+    def _context(self, entity: int, newspaper, topic) -> float:
+        """Share of the mentions of the person in the same newspaper and topic."""
+        e = self.entities[entity]
+        if not e["mentions"]:
+            return 0.0
+        shared = e["newspapers"].get(newspaper, 0) if isinstance(newspaper, str) else 0
+        shared += e["topics"].get(topic, 0) if isinstance(topic, str) else 0
+        return shared / (2 * e["mentions"])
+
+    def _match(self, normalized: str, given: tuple, surname: str, newspaper, topic):
+        candidates = [
+            entity for entity in self.blocks.get(surname, [])
+            if given_names_compatible(given, self.entities[entity]["given"])
+        ]
+        if not candidates:
+            return None
+        return max(
+            candidates,
+            key=lambda entity: (
+                self._context(entity, newspaper, topic),
+                SequenceMatcher(None, normalized, " ".join(self.entities[entity]["given"] + (surname,))).ratio(),
+                self.entities[entity]["mentions"],
+            ),
+        )
+
+    def _add_alias(self, normalized: str, entity: int):
+        self.aliases[normalized] = entity
+        self._new_aliases[normalized] = entity
+
+    def lookup(self, name: str, newspaper=None, topic=None):
+        """
+        Resolve a mention to a person, adding the person to the index if it is not there yet.
+        :param name: person name as written in the article
+        :param newspaper: newspaper of the article, to disambiguate
+        :param topic: topic of the article, to disambiguate
+        :return: id of the person, None for an empty name
+        """
+        normalized = normalize_name(name)
+        if not normalized or normalized == "nan":
+            return None
+        entity = self.aliases.get(normalized)
+        if entity is not None:
+            return entity
+
+        given, surname = split_name(normalized)
+        entity = self._match(normalized, given, surname, newspaper, topic)
+        if entity is None:
+            entity = self._next_id
+            self._next_id += 1
+            self.entities[entity] = {
+                "name": name.strip().title(),
+                "given": given,
+                "surname": surname,
+                "mentions": 0,
+                "newspapers": Counter(),
+                "topics": Counter(),
+            }
+            self.blocks.setdefault(surname, []).append(entity)
+            self._dirty.add(entity)
+        elif sum(map(len, given)) > sum(map(len, self.entities[entity]["given"])):
+            # keep the most complete name, e.g. "Draghi" -> "M. Draghi" -> "Mario Draghi"
+            self.entities[entity].update(name=name.strip().title(), given=given)
+            self._dirty.add(entity)
+        # bare surnames and initials are ambiguous, only full names are resolved with a lookup next time
+        if given and all(len(g) > 1 for g in given):
+            self._add_alias(normalized, entity)
+        return entity
+
+    def observe(self, entity: int, newspaper=None, topic=None):
+        """
+        Count a mention of the person in an article of the newspaper about the topic.
+        """
+        e = self.entities[entity]
+        e["mentions"] += 1
+        if isinstance(newspaper, str):
+            e["newspapers"][newspaper] += 1
+        if isinstance(topic, str):
+            e["topics"][topic] += 1
+        self._dirty.add(entity)
+
+    def _observed_pairs(self, links: list) -> dict:
+        """
+        :param links: links of the articles
+        :return: dict from link to the set of persons already counted in the article
+        """
+        pairs = [(link, entity) for link, entity in self._observed if link in links]
+        if self._connection is not None and links:
+            with self._lock:
+                self._connection.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (link TEXT PRIMARY KEY)")
+                self._connection.execute("DELETE FROM wanted")
+                self._connection.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((l,) for l in links))
+                pairs += self._connection.execute(
+                    f"SELECT link, entity FROM {self.table}_observed WHERE link IN (SELECT link FROM wanted)"
+                ).fetchall()
+                self._connection.commit()
+        observed = {}
+        for link, entity in pairs:
+            observed.setdefault(link, set()).add(entity)
+        return observed
+
+    def name(self, entity: int) -> str:
+        return self.entities[entity]["name"]
+
+    def resolve_names(self, names, newspaper=None, topic=None) -> list:
+        """
+        :param names: person names
+        :param newspaper: newspaper of the names, to disambiguate
+        :param topic: topic of the names, to disambiguate
+        :return: resolved display name of every name, None for the empty ones
+        """
+        names = list(names)
+        # full names first, so the bare surnames of the same batch can be resolved to them
+        order = sorted(range(len(names)), key=lambda i: not split_name(normalize_name(names[i]))[0])
+        entities = [None] * len(names)
+        for i in order:
+            entities[i] = self.lookup(names[i], newspaper, topic)
+            if entities[i] is not None:
+                self.observe(entities[i], newspaper, topic)
+        return [None if entity is None else self.name(entity) for entity in entities]
+
+    def resolve_persons(self, dataframe: pd.DataFrame, column: str = "persons") -> list:
+        """
+        Resolve the persons of every article, using the newspaper and the topics of the article as context.
+        The mentions of an article are counted once, even if it is resolved again in a later run.
+        :param dataframe: articles with the persons column (lists of names), the newspaper and topics columns
+         and the link column identifying the articles (without it, every call counts the mentions again)
+        :param column: column with the persons
+        :return: for every article, the list of resolved names, without duplicates
+        """
+        persons = [p if isinstance(p, (list, tuple)) else [] for p in dataframe[column]]
+        newspapers = dataframe["newspaper"] if "newspaper" in dataframe else [None] * len(dataframe)
+        topics = dataframe["topics"] if "topics" in dataframe else [None] * len(dataframe)
+        links = dataframe["link"].tolist() if "link" in dataframe else [None] * len(dataframe)
+        rows = list(zip(persons, newspapers, topics))
+
+        # persons already counted in the articles by a previous run
+        already = self._observed_pairs({link for link in links if isinstance(link, str)})
+        observed = [set(already.get(link, ())) for link in links]
+
+        # full names first, as in resolve_names, then the ambiguous ones with the context of the full names
+        entities = [[None] * len(names) for names in persons]
+        for full in [True, False]:
+            for (names, newspaper, topic), link, resolved, seen in zip(rows, links, entities, observed):
+                for i, name in enumerate(names):
+                    if bool(split_name(normalize_name(name))[0]) == full:
+                        resolved[i] = self.lookup(name, newspaper, topic)
+                        # a person mentioned several times in the same article counts once
+                        if resolved[i] is not None and resolved[i] not in seen:
+                            self.observe(resolved[i], newspaper, topic)
+                            seen.add(resolved[i])
+                            if isinstance(link, str):
+                                self._observed.add((link, resolved[i]))
+
+        return [
+            [self.name(entity) for entity in dict.fromkeys(e for e in resolved if e is not None)]
+            for resolved in entities
+        ]
@@ -1,21 +1,37 @@
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from tqdm import tqdm
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-from news_mapping.data.scraper import google_news_articles, scrape_url
+from news_mapping.data.scraper import google_news_articles, scrape_urls
+from news_mapping.data.cache import HTTPCache, SQLiteCache, make_key
+from news_mapping.data.dedup import near_duplicates, title_link_duplicates
+from news_mapping.data.store import ArticleStore
+from news_mapping.data.llm import PROMPT_VERSION
+from news_mapping.data.rate_limiter import RateLimiter
 from news_mapping.data.wrangler import (
-    obtain_topics_and_person,
+    obtain_topics_and_persons,
+    obtain_topics_and_persons_batched,
 )
 
+from news_mapping.text_analysis.persons import PersonIndex
 from news_mapping.text_analysis.utils import (
-    evaluate_string,
-    extract_inside_braces,
     filter_newspapers,
-    map_incomplete_to_full_names
+    parse_extraction_outputs,
+    token_budget,
+    truncate_to_token_budget,
 )
 
-from news_mapping.clustering.clustering import cluster_topics, cluster_topics_with_llm
+from news_mapping.clustering.clustering import (
+    cluster_topics,
+    cluster_topics_scalable,
+    cluster_topics_with_llm,
+)
+from news_mapping.clustering.embeddings import PretrainedEmbedder
+from news_mapping.clustering.incremental import IncrementalTopicClusterer
 
 tqdm.pandas()
 
@@ -37,7 +53,27 @@ class NewsProcess:
             topics: list = None,
             start_date: str = (datetime.today() - relativedelta(months=1)).strftime('%Y-%m-%d'),
             end_date: str = datetime.today().strftime('%Y-%m-%d'),
-            model: str = "mixtral-8x7b-32768"
+            model: str = "mixtral-8x7b-32768",
+            max_workers: int = 32,
+            per_host_limit: int = 4,
+            requests_per_minute: int = 30,
+            tokens_per_minute: int = None,
+            max_in_flight: int = 8,
+            cache_path: str = None,
+            cache_max_age: float = None,
+            cache_max_bytes: int = None,
+            search_freshness: float = 3600,
+            extractor: str = "lxml",
+            parse_workers: int = None,
+            token_budget: int = None,
+            batch_size: int = 1,
+            embeddings_path: str = None,
+            clustering_model_path: str = None,
+            deduplicate: bool = True,
+            duplicate_threshold: float = 0.8,
+            store_path: str = None,
+            checkpoint_every: int = 100,
+            persons_path: str = None,
     ):
         self.SERPAPI_KEY = serpapi_key
         self.GROQ_API_KEY = groq_api_key
@@ -47,20 +83,62 @@ class NewsProcess:
         self.end_date = end_date
         self.model = model
         self.query = query
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_in_flight = max_in_flight
+        self.llm_cache = (
+            SQLiteCache(cache_path, table="llm", max_age=cache_max_age, max_bytes=cache_max_bytes)
+            if cache_path
+            else None
+        )
+        self.http_cache = (
+            HTTPCache(cache_path, table="http", max_age=cache_max_age, max_bytes=cache_max_bytes)
+            if cache_path
+            else None
+        )
+        self.extractor = extractor
+        self.parse_workers = parse_workers
+        self.token_budget = token_budget
+        self.batch_size = batch_size
+        self.embedder = (
+            PretrainedEmbedder(
+                embeddings_path,
+                memo=SQLiteCache(cache_path, table="embeddings") if cache_path else None,
+            )
+            if embeddings_path
+            else None
+        )
+        if clustering_model_path and not embeddings_path:
+            raise ValueError("Incremental clustering needs pretrained vectors, set embeddings_path")
+        self.clustering_model_path = clustering_model_path
+        self.deduplicate = deduplicate
+        self.duplicate_threshold = duplicate_threshold
+        self.search_cache = (
+            SQLiteCache(cache_path, table="search", max_age=search_freshness) if cache_path else None
+        )
+        self.store = ArticleStore(store_path) if store_path else None
+        self.checkpoint_every = checkpoint_every
+        self.person_index = PersonIndex(persons_path)
 
     def scrape_articles(self) ->  pd.DataFrame:
         """
         Retrieve latest batch of articles from Google News, if scrape_new = True, then scrape. new batch to be
         added to the currently available batch.
         """
-        dataframe = pd.DataFrame()
-
-        for s in self.sources:
-            df_t = google_news_articles(
-                api_key=self.SERPAPI_KEY, keywords=f"{s} {self.query}"
+        with ThreadPoolExecutor(max_workers=min(len(self.sources), self.max_workers)) as executor:
+            results = executor.map(
+                lambda s: google_news_articles(
+                    api_key=self.SERPAPI_KEY, keywords=f"{s} {self.query}", cache=self.search_cache
+                ),
+                self.sources,
             )
-            dataframe = pd.concat([dataframe, df_t]).reset_index(drop=True)
+            dataframe = pd.concat(list(results)).reset_index(drop=True)
 
+        # the same article can be returned by the searches of several sources
+        dataframe = dataframe[
+            ~dataframe["link"].duplicated() | dataframe["link"].isna()
+            ].reset_index(drop=True)
 
         dataframe = dataframe.rename(columns={"source": "newspaper"})
         dataframe["date"] = pd.to_datetime(
@@ -77,59 +155,339 @@ class NewsProcess:
         dataframe = dataframe[["title", "newspaper", "link", "date"]]
         dataframe = dataframe.reset_index(drop=True)
 
+        if self.store is not None:
+            self.store.save(dataframe[dataframe["link"].notna()])
+
         return dataframe
 
+    def _fingerprints(self, cluster_with_llm: bool = True, scalable_clustering: bool = False) -> dict:
+        """
+        Fingerprint of the configuration every stage depends on, the one of the previous stage included.
+        Stored outputs are only reused by a run with the same fingerprint.
+        :return: dict from store column to fingerprint
+        """
+        text = make_key("text", self.extractor)
+        extraction = make_key(
+            "extraction", text, PROMPT_VERSION, self.query, self.model, self.topics,
+            self.token_budget or token_budget(self.model), self.batch_size,
+        )
+        if cluster_with_llm:
+            mode = ["llm", self.model]
+        elif self.clustering_model_path:
+            mode = ["incremental", self.clustering_model_path]
+        else:
+            mode = ["scalable" if scalable_clustering else "default"]
+        topic = make_key("topic", extraction, mode, self.topics, self.embedder.path if self.embedder else None)
+        persons = make_key("persons", topic, self.person_index.path)
+        return {"text": text, "extraction": extraction, "topic": topic, "persons": persons}
 
-    def process_articles(self, dataframe: pd.DataFrame, cluster_with_llm: bool = True):
+    def _run_stage(self, column: str, links: list, inputs: list, run, progress_bar=None,
+                   fingerprint: str = None) -> list:
         """
-        From scraped articles, summarize them, obtain topics and persons mentioned in the articles, and prepare
-        output for relevant use.
+        Run a stage of the pipeline over the inputs. With a store, the articles whose output is already stored
+        (with the same fingerprint) are skipped, and the outputs are saved every checkpoint_every articles,
+        so an interrupted run resumes where it stopped.
+        :param column: store column of the stage
+        :param links: link of the article of every input
+        :param inputs: inputs of the stage
+        :param run: callable from a list of inputs to the list of their outputs, None where the stage failed
+        :param progress_bar: optional tqdm bar, advanced by the skipped articles too
+        :param fingerprint: configuration of the stage, see _fingerprints
+        :return: outputs in the same order as inputs
         """
+        outputs = [None] * len(inputs)
+        stored = self.store.completed(column, links, fingerprint) if self.store is not None else {}
+        todo = []
+        for i, link in enumerate(links):
+            if link in stored:
+                outputs[i] = stored[link]
+            else:
+                todo.append(i)
+        if len(todo) < len(inputs):
+            print(f"{len(inputs) - len(todo)} articles already completed the {column} stage")
+            if progress_bar is not None:
+                progress_bar.update(len(inputs) - len(todo))
 
-        print("Scraping URLs")
-        dataframe["text"] = dataframe["link"].progress_apply(
-            lambda url: scrape_url(url=url)
-        )
+        step = self.checkpoint_every if self.store is not None else max(len(todo), 1)
+        for start in range(0, len(todo), step):
+            chunk = todo[start:start + step]
+            results = run([inputs[i] for i in chunk])
+            for i, result in zip(chunk, results):
+                outputs[i] = result
+            if self.store is not None:
+                self.store.save(pd.DataFrame({
+                    "link": [links[i] for i in chunk], column: results, f"{column}_key": fingerprint,
+                }))
+        return outputs
 
-        dataframe = dataframe[
-            dataframe["text"].astype(str).apply(len) < 15000
-            ].reset_index(drop=True)
+    def _save_stage(self, dataframe: pd.DataFrame, column: str, store_column: str, fingerprint: str = None):
+        if self.store is not None:
+            rows = dataframe[dataframe["link"].notna()]
+            self.store.save(pd.DataFrame({
+                "link": rows["link"].values, store_column: rows[column].values, f"{store_column}_key": fingerprint,
+            }))
 
-        print("Extracting Topics And Persons From Articles")
-        dataframe["topics_persons"] = dataframe["text"].progress_apply(
-            lambda text: obtain_topics_and_person(
-                text=text,
-                api_key=self.GROQ_API_KEY,
-                query=self.query,
-                topics_to_scrape=self.topics,
-                model=self.model,
-            )
+    def _stored_stage(self, dataframe: pd.DataFrame, store_column: str, fingerprint: str = None):
+        """
+        :return: the stored outputs of a corpus-level stage for every row, or None if some rows miss them
+         or were computed with another configuration
+        """
+        if self.store is None:
+            return None
+        stored = self.store.completed(store_column, dataframe["link"].tolist(), fingerprint)
+        if not dataframe["link"].isin(stored.keys()).all():
+            return None
+        print(f"Loaded the {store_column} stage from the store")
+        return dataframe["link"].map(stored)
+
+
+    def _fetch_texts(self, dataframe: pd.DataFrame, progress_bar=None) -> pd.DataFrame:
+        """
+        Fetch stage: the text of one article per title/link duplicate cluster is fetched and copied to the others.
+        When the fetch of an article fails, the next article of its cluster is tried.
+        :return: the articles with a text column, without the ones that could not be fetched
+        """
+        dataframe = dataframe.reset_index(drop=True)
+        groups = title_link_duplicates(dataframe) if self.deduplicate else np.arange(len(dataframe))
+        members = {}
+        for i, group in enumerate(groups):
+            members.setdefault(group, []).append(i)
+        if len(members) < len(dataframe):
+            print(f"{len(dataframe) - len(members)} articles share the title or link of another one")
+
+        fingerprint = self._fingerprints()["text"]
+        texts = {}
+        candidates = list(members)
+        attempt = 0
+        if progress_bar is None:
+            print("Scraping URLs")
+        with tqdm(total=len(candidates)) if progress_bar is None else nullcontext(progress_bar) as bar:
+            while candidates:
+                links = dataframe["link"].iloc[[members[group][attempt] for group in candidates]].tolist()
+                if attempt:
+                    print(f"Fetching another article of {len(candidates)} clusters whose article failed")
+                    bar.total += len(candidates)
+                    bar.refresh()
+                fetched = self._run_stage(
+                    "text",
+                    links,
+                    links,
+                    lambda chunk: scrape_urls(
+                        chunk,
+                        max_workers=self.max_workers,
+                        per_host_limit=self.per_host_limit,
+                        progress=bar.update,
+                        http_cache=self.http_cache,
+                        extractor=self.extractor,
+                        parse_workers=self.parse_workers,
+                    ),
+                    bar,
+                    fingerprint,
+                )
+                texts.update((group, text) for group, text in zip(candidates, fetched) if text is not None)
+                attempt += 1
+                candidates = [
+                    group for group in candidates if group not in texts and attempt < len(members[group])
+                ]
+        dataframe["text"] = pd.Series(groups).map(texts).values
+        dataframe = dataframe[dataframe["text"].notna()].reset_index(drop=True)
+        self._save_stage(dataframe, "text", "text", fingerprint)
+        return dataframe
+
+    def _extract_records(self, dataframe: pd.DataFrame, progress_bar=None) -> pd.DataFrame:
+        """
+        Extract and parse stages: texts are trimmed to the token budget, one article per near-duplicate cluster
+        is sent to the LLM, and its summary, topic and persons are copied to the others.
+        :return: one small record per article (title, newspaper, link, date, summary, topic and persons),
+         the full texts are not kept
+        """
+        budget = self.token_budget or token_budget(self.model)
+        truncated = [truncate_to_token_budget(text, self.query, budget) for text in dataframe["text"]]
+        texts = [text for text, _ in truncated]
+        print(
+            f"Trimmed {sum(saved > 0 for _, saved in truncated)} articles to {budget} tokens, "
+            f"saving {sum(saved for _, saved in truncated)} tokens"
         )
+        del truncated
 
-        dataframe["topics_persons"] = (
-            dataframe["topics_persons"].apply(extract_inside_braces).apply(evaluate_string)
+        groups = (
+            near_duplicates(texts, threshold=self.duplicate_threshold)
+            if self.deduplicate
+            else np.arange(len(texts))
         )
+        representatives = np.unique(groups)
+        if len(representatives) < len(texts):
+            print(f"{len(texts) - len(representatives)} articles are near duplicates of another one")
+        texts = [texts[i] for i in representatives]
 
-        dataframe = dataframe[(dataframe["topics_persons"] != {})]
+        errors = []
+        totals = {"requests": 0, "cached": 0, "tokens": 0}
+        fingerprint = self._fingerprints()["extraction"]
 
-        dataframe["text"] = dataframe["topics_persons"].apply(lambda x: x["text"])
-        dataframe["topics"] = dataframe["topics_persons"].apply(lambda x: x["topic"])
-        dataframe["persons"] = dataframe["topics_persons"].apply(lambda x: x["persons"])
+        def extract(chunk):
+            if self.batch_size > 1:
+                outputs, chunk_errors, stats = obtain_topics_and_persons_batched(
+                    chunk,
+                    api_key=self.GROQ_API_KEY,
+                    query=self.query,
+                    topics_to_scrape=self.topics,
+                    model=self.model,
+                    rate_limiter=self.rate_limiter,
+                    cache=self.llm_cache,
+                    batch_token_budget=budget,
+                    max_batch_size=self.batch_size,
+                    max_in_flight=self.max_in_flight,
+                    progress=bar.update,
+                )
+            else:
+                stats = {}
+                outputs, chunk_errors = obtain_topics_and_persons(
+                    chunk,
+                    api_key=self.GROQ_API_KEY,
+                    query=self.query,
+                    topics_to_scrape=self.topics,
+                    model=self.model,
+                    rate_limiter=self.rate_limiter,
+                    cache=self.llm_cache,
+                    max_in_flight=self.max_in_flight,
+                    progress=bar.update,
+                    stats=stats,
+                )
+            for key in totals:
+                totals[key] += stats[key]
+            errors.extend(chunk_errors)
+            # failed calls are not saved, so a rerun tries them again
+            return [output if error is None else None for output, error in zip(outputs, chunk_errors)]
 
-        dataframe = dataframe[dataframe["topics"] != ""]
+        if progress_bar is None:
+            print("Extracting Topics And Persons From Articles")
+        with tqdm(total=len(texts)) if progress_bar is None else nullcontext(progress_bar) as bar:
+            outputs = self._run_stage(
+                "extraction", dataframe["link"].iloc[representatives].tolist(), texts, extract, bar, fingerprint
+            )
+        del texts
+        # one error (or None) per article sent to the extraction, the stored ones excluded
+        extracted = len(errors)
+        if extracted:
+            print(
+                f"{totals['requests'] / extracted:.2f} requests and "
+                f"{totals['tokens'] / extracted:.0f} tokens per article, {totals['cached']} answers from the cache"
+            )
+        failed = sum(error is not None for error in errors)
+        if failed:
+            print(f"Extraction failed for {failed} articles out of {extracted}")
 
-        dataframe = dataframe[["title", "newspaper", "link", "date", "text", "topics", "persons"]]
+        # every member of a duplicate cluster gets the extraction of its representative
+        records = dataframe[["title", "newspaper", "link", "date"]].copy()
+        records["extraction"] = pd.Series(outputs, index=representatives, dtype=object).reindex(groups).values
+        self._save_stage(records[records["extraction"].notna()], "extraction", "extraction", fingerprint)
 
-        if cluster_with_llm:
-            dataframe = cluster_topics_with_llm(dataframe, self.GROQ_API_KEY, self.model, self.topics)
+        parsed, failures = parse_extraction_outputs(records.pop("extraction"))
+        if failures:
+            print(f"Unparseable LLM outputs: {dict(failures)}")
+
+        records = records[parsed.notna()]
+        parsed = parsed[parsed.notna()]
+        records["text"] = [x["text"] for x in parsed]
+        records["topics"] = [x["topic"] for x in parsed]
+        records["persons"] = [x["persons"] for x in parsed]
+
+        return records[records["topics"] != ""]
+
+    def iter_records(self, dataframe: pd.DataFrame, chunk_size: int = 100):
+        """
+        Streaming version of the fetch, extract and parse stages: articles go through them chunk_size title/link
+        duplicate clusters at a time, and only the small per-article records of every chunk are yielded, so the
+        pages and texts of a single chunk are in memory at any time.
+        Near duplicates are only looked for within a chunk.
+        :param dataframe: articles returned by scrape_articles
+        :param chunk_size: number of articles fetched and extracted together
+        :return: generator of dataframes of records, as returned by _extract_records
+        """
+        dataframe = dataframe.reset_index(drop=True)
+        groups = title_link_duplicates(dataframe) if self.deduplicate else np.arange(len(dataframe))
+        representatives = np.unique(groups)
+        with tqdm(total=len(representatives), desc="Fetching") as fetch_bar, \
+                tqdm(desc="Extracting") as extract_bar:
+            for start in range(0, len(representatives), chunk_size):
+                chunk = dataframe[np.isin(groups, representatives[start:start + chunk_size])]
+                fetched = self._fetch_texts(chunk, fetch_bar)
+                extract_bar.total = (extract_bar.total or 0) + len(fetched)
+                yield self._extract_records(fetched, extract_bar)
+                del fetched
+
+    def process_articles(
+            self,
+            dataframe: pd.DataFrame,
+            cluster_with_llm: bool = True,
+            scalable_clustering: bool = False,
+            chunk_size: int = None,
+    ):
+        """
+        From scraped articles, summarize them, obtain topics and persons mentioned in the articles, and prepare
+        output for relevant use.
+        If scalable_clustering is True and cluster_with_llm is False, unique topics are clustered once with
+        MiniBatchKMeans or HDBSCAN on a reduced projection, for large corpora.
+        If deduplicate is True, articles with the same title or link are fetched once, and articles with
+        near-duplicate texts (MinHash/LSH) are sent to the LLM once, the results being copied to every newspaper.
+        If a clustering_model_path was given and cluster_with_llm is False, the topics are assigned to the clusters
+        of the model saved by the previous runs, which is updated and saved again.
+        If a store_path was given, the output of every stage (fetch, extract, cluster, resolve persons) is saved to
+        the article store as it is produced, and a rerun skips the articles that already completed a stage with the
+        same configuration (extractor, query, model, topics, clustering mode...).
+        Persons are resolved with the person index (see PersonIndex), persisted in persons_path across runs if given.
+        If chunk_size is given, articles are streamed chunk by chunk through fetch and extraction (see
+        iter_records), so the peak memory does not grow with the number of articles.
+        """
+        if chunk_size:
+            chunks = list(self.iter_records(dataframe, chunk_size))
+            dataframe = (
+                pd.concat(chunks, ignore_index=True) if chunks
+                else self._extract_records(self._fetch_texts(dataframe))
+            )
+            del chunks
         else:
-            dataframe = cluster_topics(dataframe, self.topics)
+            dataframe = self._extract_records(self._fetch_texts(dataframe))
 
-        dataframe = dataframe.explode("persons")
-        dataframe["persons"] = dataframe["persons"].astype(str)
-        dataframe["persons"] = dataframe["persons"].str.title()
-        dataframe["persons"] = map_incomplete_to_full_names(dataframe["persons"])
-        dataframe = dataframe.groupby(["title", "newspaper", "link",
-                                       "date", "text", "topics"], as_index=False).agg({"persons": list})
+        fingerprints = self._fingerprints(cluster_with_llm, scalable_clustering)
+        stored_topics = self._stored_stage(dataframe, "topic", fingerprints["topic"])
+        if stored_topics is not None:
+            dataframe["topics"] = stored_topics
+        elif cluster_with_llm:
+            dataframe = cluster_topics_with_llm(
+                dataframe,
+                self.GROQ_API_KEY,
+                self.model,
+                self.topics,
+                rate_limiter=self.rate_limiter,
+                cache=self.llm_cache,
+                embedder=self.embedder,
+                max_in_flight=self.max_in_flight,
+            )
+        elif self.clustering_model_path:
+            clusterer = IncrementalTopicClusterer.load(
+                self.clustering_model_path, self.embedder, topics=self.topics
+            )
+            dataframe = clusterer.update(dataframe)
+            clusterer.save(self.clustering_model_path)
+        elif scalable_clustering:
+            dataframe = cluster_topics_scalable(dataframe, self.topics, embedder=self.embedder)
+        else:
+            dataframe = cluster_topics(dataframe, self.topics, embedder=self.embedder)
+        if stored_topics is None:
+            self._save_stage(dataframe, "topics", "topic", fingerprints["topic"])
 
-        return dataframe
+        stored_persons = self._stored_stage(dataframe, "persons", fingerprints["persons"])
+        if stored_persons is not None:
+            dataframe["persons"] = stored_persons
+        else:
+            dataframe["persons"] = self.person_index.resolve_persons(dataframe)
+            self.person_index.save()
+            self._save_stage(dataframe, "persons", "persons", fingerprints["persons"])
+
+        if self.llm_cache is not None:
+            print(f"HTTP cache: {self.http_cache.stats()}")
+            print(f"LLM cache: {self.llm_cache.stats()}")
+
+        # the clustering functions and the resumed stages leave different helper columns
+        return dataframe[["title", "newspaper", "link", "date", "text", "topics", "persons"]].reset_index(drop=True)
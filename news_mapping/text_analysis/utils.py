@@ -1,5 +1,36 @@
+import ast
+import json
+import re
+import threading
+from collections import Counter
+
+from typing import TYPE_CHECKING
+
 import pandas as pd
-import tiktoken
+
+from news_mapping.text_analysis.persons import PersonIndex
+
+DEFAULT_TOKEN_BUDGET = 4000
+MODEL_TOKEN_BUDGETS = {
+    "llama3-70b-8192": 4000,
+    "llama3-8b-8192": 4000,
+    "gemma2-9b-it": 4000,
+    "mixtral-8x7b-32768": 8000,
+}
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+WORD = re.compile(r"\w+")
+DEFAULT_ENCODING = "o200k_base"
+BRACES = re.compile(r"[{}]")
+TRAILING_COMMA = re.compile(r",\s*([}\]])")
+MISSING_COMMA = re.compile(r'"\s+"(?=[^"]+"\s*:)')
+
+if TYPE_CHECKING:
+    import tiktoken
+
+JSON_DECODER = json.JSONDecoder()
+
+_encodings = {}
+_encodings_lock = threading.Lock()
 
 def contains_any_word(row, words):
     return any(word in row.split() for word in words)
@@ -14,36 +45,139 @@ def if_contains_assign(row, words, keywords):
             return word_dict[keyword]
     return None
 
+def _loads(expression: str):
+    """
+    Parse a JSON object from an LLM output without ever executing it: strict JSON first, then JSON after
+    repairing smart quotes, control characters, trailing commas and missing commas between keys,
+    and finally python literals (single quotes, True/None) with ast.literal_eval.
+    :return: the parsed value, or raise ValueError
+    """
+    try:
+        return json.loads(expression)
+    except ValueError:
+        pass
+    repaired = clean_json_string(expression)
+    repaired = TRAILING_COMMA.sub(r"\1", repaired)
+    repaired = MISSING_COMMA.sub(r'", "', repaired)
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(repaired)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError) as e:
+        raise ValueError(str(e)) from e
+
+
 def evaluate_string(expression):
     try:
-        result = eval(expression)
-        return result
-    except Exception as e:
+        return _loads(expression)
+    except ValueError as e:
         print(f"Error evaluating expression '{expression}': {e}")
-        return "{}"
+        return {}
 
 def extract_inside_braces(string: str) -> str:
+    """
+    :param string: LLM output
+    :return: the first object of the output, from its opening to its closing brace, "{}" if there is none
+     or it is never closed
+    """
+    start_index = string.find("{")
+    if start_index == -1:
+        return "{}"
+    # a valid JSON object is delimited by the decoder, braces inside its strings included
+    try:
+        _, end_index = JSON_DECODER.raw_decode(string, start_index)
+        return string[start_index:end_index]
+    except ValueError:
+        pass
+
+    # Jump from brace to brace to find the bracket closing the first one
     bracket_count = 0
-    start_index = -1
-    end_index = -1
-
-    # Iterate through the string to find the outermost brackets
-    for i, char in enumerate(string):
-        if char == '{':
-            if bracket_count == 0:  # First opening bracket
-                start_index = i
+    for match in BRACES.finditer(string, start_index):
+        if match.group() == "{":
             bracket_count += 1
-        elif char == '}':
+        else:
             bracket_count -= 1
-            if bracket_count == 0:  # Last closing bracket
-                end_index = i + 1  # Include the closing bracket
-                break
+            if bracket_count == 0:
+                return string[start_index:match.end()]
+    return "{}"
+
+
+def load_first_object(string: str):
+    """
+    Parse the first JSON object of an LLM output: strict JSON decoded from the first brace, and only if that
+    fails, the text up to the matching closing brace with the repairs of _loads.
+    :param string: LLM output
+    :return: the parsed value, None if the output has no object. Raise ValueError if the object is not parseable,
+     unbalanced or truncated
+    """
+    start_index = string.find("{")
+    if start_index == -1:
+        return None
+    try:
+        return JSON_DECODER.raw_decode(string, start_index)[0]
+    except ValueError:
+        pass
+    expression = extract_inside_braces(string)
+    if expression == "{}":
+        raise ValueError("unbalanced or truncated object")
+    return _loads(expression)
+
+
+def validate_extraction(value) -> dict:
+    """
+    Check that an extraction output has the text, topic and persons keys, with the expected types.
+    A single person given as a string or a missing list of persons are coerced to a list.
+    :param value: parsed output
+    :return: dict with text (str), topic (str) and persons (list of str), or None if not valid.
+    """
+    if not isinstance(value, dict) or not isinstance(value.get("text"), str):
+        return None
+    topic = value.get("topic")
+    if not isinstance(topic, str):
+        return None
+    persons = value.get("persons")
+    if persons is None:
+        persons = []
+    elif isinstance(persons, str):
+        persons = [persons] if persons else []
+    elif not isinstance(persons, list):
+        return None
+    return {
+        "text": value["text"],
+        "topic": topic,
+        "persons": [str(p) for p in persons if p],
+    }
+
+
+def parse_extraction_outputs(outputs: pd.Series) -> tuple:
+    """
+    Parse the topic and person extraction outputs of a whole column.
+    :param outputs: series of LLM outputs
+    :return: series of dicts with text, topic and persons (None where parsing failed, same index as outputs),
+     and a Counter of the failures by kind: "empty" (no JSON object), "json" (not parseable, unbalanced or
+     truncated), "schema" (wrong keys).
+    """
+    failures = Counter()
+    parsed = []
+    for output in outputs.fillna("").astype(str):
+        try:
+            value = load_first_object(output)
+        except ValueError:
+            failures["json"] += 1
+            parsed.append(None)
+            continue
+        if value is None:
+            failures["empty"] += 1
+            parsed.append(None)
+            continue
+        value = validate_extraction(value)
+        if value is None:
+            failures["schema"] += 1
+        parsed.append(value)
+    return pd.Series(parsed, index=outputs.index, dtype=object), failures
 
-    # Extract the substring that contains the list
-    if start_index != -1 and end_index != -1:
-        return string[start_index:end_index]
-    else:
-        return "{}"
 
 def additional_filter(dataframe: pd.DataFrame, match_words: list) -> pd.DataFrame:
     """ """
@@ -69,37 +203,97 @@ def filter_newspapers(dataframe: pd.DataFrame, accepted_newspapers: list) -> pd.
 
 def map_incomplete_to_full_names(names) -> list:
     """
+    Map bare surnames and partial names to the full names of the same list, e.g. "Draghi" -> "Mario Draghi".
+    Kept for compatibility, the pipeline resolves persons with a persistent PersonIndex.
+    :param names: person names
+    :return: resolved name of every name
     """
-    surname_to_fullname = {}
-
-    # First pass: collect full names
-    for name in names:
-        parts = name.strip().split()
-        if len(parts) >= 2:
-            # Full name case (first and last name)
-            surname = parts[-1]  # Last part is the surname
-            surname_to_fullname[surname] = name  # Map surname to full name
-
-    # Second pass: replace incomplete names with full names when possible
-    mapped_names = []
-    for name in names:
-        parts = name.strip().split()
-        if len(parts) == 1:
-            # Only surname provided
-            surname = parts[0]
-            # Replace with full name if found
-            full_name = surname_to_fullname.get(surname, name)
-            mapped_names.append(full_name)
-        else:
-            # Full name already provided
-            mapped_names.append(name)
+    names = list(names)
+    resolved = PersonIndex().resolve_names(names)
+    return [name if full_name is None else full_name for name, full_name in zip(names, resolved)]
+
+
+def get_encoding(name: str = DEFAULT_ENCODING) -> "tiktoken.Encoding":
+    """
+    Tiktoken encoder loaded once per encoding name and shared by every caller.
+    :param name: name of the encoding
+    :return: the encoder
+    """
+    if name not in _encodings:
+        with _encodings_lock:
+            if name not in _encodings:
+                import tiktoken
+
+                _encodings[name] = tiktoken.get_encoding(name)
+    return _encodings[name]
+
+
+def calculate_token(string: str, encoding: str = DEFAULT_ENCODING) -> int:
+    return len(get_encoding(encoding).encode(string, disallowed_special=()))
+
+
+def calculate_tokens(strings: list, encoding: str = DEFAULT_ENCODING, num_threads: int = 8) -> list:
+    """
+    Number of tokens of every string, encoded in batch on tiktoken's thread pool.
+    :param strings: list of strings
+    :param encoding: name of the encoding
+    :param num_threads: threads used by tiktoken
+    :return: list of token counts in the same order as strings
+    """
+    tokens = get_encoding(encoding).encode_batch(
+        list(strings), num_threads=num_threads, disallowed_special=()
+    )
+    return [len(t) for t in tokens]
+
+
+def token_budget(model: str) -> int:
+    """
+    :param model: model adopted
+    :return: max tokens of article text sent to the model
+    """
+    return MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+
+
+def truncate_to_token_budget(text: str, query: str, budget: int) -> tuple:
+    """
+    Trim an article to a token budget, keeping the paragraphs most relevant to the query.
+    Paragraphs are ranked by how many words of the query they contain (the first one, usually the title,
+    is always kept first), they are added while they fit in the budget and put back in their original order.
+    Texts without new lines are split into sentences.
+    :param text: text of the article
+    :param query: keywords the articles are about
+    :param budget: max number of tokens of the returned text
+    :return: the trimmed text and the number of tokens saved
+    """
+    enc = get_encoding()
+    total = calculate_token(text)
+    if total <= budget:
+        return text, 0
+
+    separator = "\n" if "\n" in text else " "
+    paragraphs = [p for p in (text.split("\n") if separator == "\n" else SENTENCE_END.split(text)) if p.strip()]
+    query_words = {w for w in WORD.findall(query.casefold()) if len(w) > 2}
+
+    def relevance(i):
+        if i == 0:
+            return float("inf")
+        return sum(w in query_words for w in WORD.findall(paragraphs[i].casefold()))
 
-    return mapped_names
+    lengths = calculate_tokens(paragraphs)
+    kept = []
+    used = 0
+    for i in sorted(range(len(paragraphs)), key=lambda i: (-relevance(i), i)):
+        if used + lengths[i] <= budget:
+            kept.append(i)
+            used += lengths[i]
 
+    if not kept:
+        # a single paragraph larger than the budget, cut it
+        trimmed = enc.decode(enc.encode(paragraphs[0], disallowed_special=())[:budget])
+        return trimmed, total - budget
 
-def calculate_token(string: str) -> int:
-    enc = tiktoken.get_encoding("o200k_base")
-    return len(enc.encode(string))
+    trimmed = separator.join(paragraphs[i] for i in sorted(kept))
+    return trimmed, total - used
 
 
 def clean_json_string(input_string):